@@ -1,35 +1,161 @@
 import os
 import json
+import time
 from base_agent import BaseAgent
 from state import *
 from environment import *
+from bench_scripts import TEST_STAGES, read_test_script, script_path, repo_numbers
 
-default_stages = [
-            '# Environment Setup / Requirement / Installation',
-            '# Data / Checkpoint / Weight Download (URL)',
-            '# Training',
-            '# Inference / Demonstration',
-            '# Testing / Evaluation'
-        ]
+default_stages = list(TEST_STAGES)
+
+# Per-stage budgets: (timeout per command, wall-clock budget for the whole stage), in seconds
+default_budgets = {
+    'Environment Setup / Requirement / Installation': (1800, 3600),
+    'Data / Checkpoint / Weight Download (URL)': (1800, 3600),
+    'Training': (7200, 14400),
+    'Inference / Demonstration': (1800, 3600),
+    'Testing / Evaluation': (1800, 3600)
+}
 
 class Benchmark:
-    def __init__(self, environment: Environment, stages=None, results_dir='results'):
+    """
+    Runs a repo's benchmark test script as a staged pipeline.
+
+    The script's commands are grouped under its stage headers (Setup, Download, Training,
+    Inference, Testing). Each stage runs with its own per-command timeout and wall-clock budget
+    (commands left when the budget runs out are skipped), is graded in one batch, and records
+    wall time, command counts, LLM usage and pass rate. With `short_circuit`, a stage whose pass
+    rate falls below `min_pass_rate` stops the pipeline and the remaining stages are skipped.
+
+    An optional agent phase (agent.run) is recorded the same way before the first stage.
+    Results are written to `<results_dir>/<repo_name>.json`.
+    """
+
+    def __init__(self, environment: Environment, stages=None, results_dir='results', budgets=None,
+                 short_circuit=True, min_pass_rate=0.5):
         self.environment = environment
         self.stages = stages if stages is not None else default_stages
         self.results_dir = results_dir
+        self.budgets = dict(default_budgets, **(budgets or {}))
+        self.short_circuit = short_circuit
+        self.min_pass_rate = min_pass_rate
         os.makedirs(self.results_dir, exist_ok=True)
 
-    def run(self, agent: BaseAgent):
-        repo_name = os.path.basename(self.working_dir.rstrip("/"))
+    @staticmethod
+    def _usage_delta(before: dict, after: dict) -> dict:
+        return {key: after[key] - before.get(key, 0) for key in after}
+
+    def _llm_usage(self, agent=None) -> dict:
+        usage = dict(self.environment.evaluator.LLM.usage)
+        if agent is not None and hasattr(agent, "LLM"):
+            for key, value in agent.LLM.usage.items():
+                usage[key] = usage.get(key, 0) + value
+        return usage
+
+    def _run_agent(self, agent, cycles=None) -> dict:
+        usage = self._llm_usage(agent)
+        start = time.monotonic()
+        try:
+            output, count = agent.run(self.environment, cycles=cycles) if cycles else agent.run(self.environment)
+            error = None
+        except Exception as e:
+            output, count, error = 0, None, str(e)
+        result = {
+            "status": "completed" if error is None else "error",
+            "setup_complete": bool(output),
+            "cycles": count,
+            "wall_time": round(time.monotonic() - start, 3),
+            "usage": self._usage_delta(usage, self._llm_usage(agent))
+        }
+        if error is not None:
+            result["error"] = error
+        return result
+
+    def _run_stage(self, stage: str, commands: list) -> dict:
+        timeout, budget = self.budgets.get(stage, (None, None))
+        usage = self._llm_usage()
+        start = time.monotonic()
+        states = []
+        skipped = 0
+
+        for command in commands:
+            elapsed = time.monotonic() - start
+            if budget is not None and elapsed >= budget:
+                skipped += 1
+                continue
+            command_timeout = timeout
+            if budget is not None:
+                command_timeout = min(timeout or budget, budget - elapsed)
+            states.append(self.environment.execute(Action(command, agent_name="TEST"), timeout=command_timeout, stage=stage))
 
+        verdicts = []
+        if states:
+            verdicts = self.environment.evaluator.query_batch(
+                [(state.action.command, state.output, state.exit_code) for state in states]
+            )
+            for state, verdict in zip(states, verdicts):
+                self.environment.set_eval(state, 'SUCCESS' if verdict else 'FAILED')
+
+        passed = sum(1 for verdict in verdicts if verdict)
+        pass_rate = passed / len(commands) if commands else None
+        if not commands:
+            status = "empty"
+        elif pass_rate >= self.min_pass_rate:
+            status = "passed"
+        else:
+            status = "failed"
+
+        return {
+            "status": status,
+            "commands": len(commands),
+            "executed": len(states),
+            "skipped": skipped,
+            "passed": passed,
+            "pass_rate": round(pass_rate, 3) if pass_rate is not None else None,
+            "timed_out": sum(1 for state in states if state.result is not None and state.result.killed),
+            "wall_time": round(time.monotonic() - start, 3),
+            "command_seconds": round(sum(state.result.wall_time for state in states if state.result is not None), 3),
+            "usage": self._usage_delta(usage, self._llm_usage()),
+            "timeout": timeout,
+            "budget": budget
+        }
+
+    def run(self, agent: BaseAgent = None, test_number=None, cycles=None) -> dict:
+        repo_name = self.environment.REPO_NAME
+        if test_number is None:
+            test_number = repo_numbers()[repo_name]
+
+        staged = read_test_script(script_path(test_number))
+        result_log = {}
+        if agent is not None:
+            result_log['agent'] = self._run_agent(agent, cycles=cycles)
+
+        # Test scripts run from the repository root
+        self.environment.execute(Action("cd /workspace", agent_name="TEST"))
+
+        stopped_by = None
         for stage in self.stages:
-            result = agent.step()
-            result_log = {}
+            # Commands above the first header belong to the first stage
+            commands = [command for command_stage, command in staged if (command_stage or self.stages[0]) == stage]
+            if stopped_by is not None:
+                result_log[stage] = {"status": "skipped", "commands": len(commands), "reason": f"'{stopped_by}' failed"}
+                continue
+            print(f"[{repo_name}] stage '{stage}': {len(commands)} commands")
+            result_log[stage] = self._run_stage(stage, commands)
+            if self.short_circuit and result_log[stage]["status"] == "failed":
+                stopped_by = stage
 
-        
-        result_log['staged'] = result
+        stage_results = [result_log[stage] for stage in self.stages]
+        result_log['summary'] = {
+            "passed": sum(result.get("passed", 0) for result in stage_results),
+            "commands": sum(result["commands"] for result in stage_results),
+            "wall_time": round(sum(result.get("wall_time", 0) for result in stage_results), 3),
+            "stopped_by": stopped_by
+        }
 
-        self._log_results(repo_name, result_log, readme_path, working_dir, ['unstaged'])
+        readme_path = os.path.join(self.environment.repo_path, "README.md")
+        self._log_results(repo_name, result_log, readme_path, self.environment.repo_path, self.stages)
+        return result_log
 
     def _log_results(self, repo_name: str, results: dict, readme_path: str, working_dir: str, stages: list):
         log_object = {
@@ -44,4 +170,3 @@ class Benchmark:
         with open(output_path, 'w') as f:
             json.dump(log_object, f, indent=2)
         print(f"Saved results to {output_path}")
-
@@ -0,0 +1,53 @@
+import os
+
+SCRIPTS_DIR = "./data/CSR_bench_scripts"
+REPO_LIST = "./data/meta/CSRBench100_full.txt"
+
+# Stage headers of the benchmark test scripts in data/CSR_bench_scripts/*.sh, in order
+TEST_STAGES = [
+    'Environment Setup / Requirement / Installation',
+    'Data / Checkpoint / Weight Download (URL)',
+    'Training',
+    'Inference / Demonstration',
+    'Testing / Evaluation'
+]
+
+
+def read_test_script(bash_file):
+    """
+    Parse a benchmark test script into (stage, command) pairs.
+    Lines ending in a backslash are joined; the stage is the last TEST_STAGES header seen (or None).
+    """
+    commands = []
+    current_cmd = []
+    stage = None
+
+    with open(bash_file) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("#") and line.lstrip("#").strip() in TEST_STAGES:
+                stage = line.lstrip("#").strip()
+            # skip comments and empty lines
+            if not line or line.startswith("#"):
+                continue
+
+            # if line ends with \, continue building the command
+            if line.endswith("\\"):
+                current_cmd.append(line[:-1].strip())
+            else:
+                current_cmd.append(line)
+                # end of a full command
+                commands.append((stage, " ".join(current_cmd)))
+                current_cmd = []
+
+    return commands
+
+
+def script_path(num: int) -> str:
+    return os.path.join(SCRIPTS_DIR, f"{num}.sh")
+
+
+def repo_numbers(repo_list=REPO_LIST) -> dict:
+    """Map repo name (last URL segment) to its benchmark number."""
+    with open(repo_list) as f:
+        return {line.strip().rstrip('/').rsplit('/', 1)[-1]: i for i, line in enumerate(f, start=1) if line.strip()}
@@ -0,0 +1,140 @@
+import threading
+import json
+import time
+import os
+from collections import defaultdict
+from state import State
+
+
+class RunCheckpoint:
+    """
+    Durable checkpoint of a benchmark run, so an interrupted sweep can be resumed.
+
+    Each run gets a directory `<root>/<run_id>/` holding:
+        manifest.json - the run's arguments, repo list and results file (written once)
+        journal.jsonl - append-only event log, one JSON object per line, fsynced per event:
+            {"event": "start",  "repo": ..., "attempt": n, "resumed": bool}
+            {"event": "state",  "repo": ..., "agent": ..., "state": State.to_dict()}
+            {"event": "finish", "repo": ..., "attempt": n, "success": bool, "record": ...}
+
+    Loading replays the journal: repos with a "finish" event are done (or have used up their
+    attempts); for every other repo the states of its latest attempt are kept so the attempt
+    can be continued instead of restarted. A resumed attempt appends to the states of the
+    attempt it continues. A torn last line (crash mid-write) is ignored.
+    """
+
+    def __init__(self, run_id: str, root="./data/runs"):
+        self.run_id = run_id
+        self.dir = os.path.join(root, run_id)
+        self.manifest_path = os.path.join(self.dir, "manifest.json")
+        self.journal_path = os.path.join(self.dir, "journal.jsonl")
+        self.manifest = None
+
+        self.finished = {}                  # repo -> {"success", "attempts", "record"}
+        self.attempts = defaultdict(int)    # repo -> finished attempts
+        self.pending = {}                   # repo -> state dicts of its unfinished attempt
+
+        self._lock = threading.Lock()
+        self._journal = None
+
+    @classmethod
+    def create(cls, run_id: str, manifest: dict, root="./data/runs"):
+        checkpoint = cls(run_id, root=root)
+        os.makedirs(checkpoint.dir, exist_ok=True)
+        if os.path.exists(checkpoint.manifest_path):
+            raise FileExistsError(f"Run {run_id} already exists; use --resume {run_id}")
+        checkpoint.manifest = dict(manifest, run_id=run_id, created=time.time())
+        tmp_path = checkpoint.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(checkpoint.manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, checkpoint.manifest_path)
+        checkpoint._open()
+        return checkpoint
+
+    @classmethod
+    def load(cls, run_id: str, root="./data/runs"):
+        checkpoint = cls(run_id, root=root)
+        if not os.path.exists(checkpoint.manifest_path):
+            raise FileNotFoundError(f"No run {run_id} under {root}")
+        with open(checkpoint.manifest_path, encoding="utf-8") as f:
+            checkpoint.manifest = json.load(f)
+        checkpoint._replay()
+        checkpoint._open()
+        return checkpoint
+
+    def _replay(self):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                repo = event.get("repo")
+                kind = event.get("event")
+                if kind == "start":
+                    if not event.get("resumed"):
+                        self.pending[repo] = []
+                elif kind == "state":
+                    self.pending.setdefault(repo, []).append(event)
+                elif kind == "finish":
+                    self.attempts[repo] += 1
+                    self.pending.pop(repo, None)
+                    self.finished[repo] = {
+                        "success": event.get("success"),
+                        "attempts": self.attempts[repo],
+                        "record": event.get("record")
+                    }
+
+    def _open(self):
+        # Cut off a torn last line so the next event doesn't get glued onto it
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "rb+") as f:
+                data = f.read()
+                if data and not data.endswith(b"\n"):
+                    f.truncate(data.rfind(b"\n") + 1)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    def _append(self, event: dict):
+        line = json.dumps(event) + "\n"
+        with self._lock:
+            self._journal.write(line)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+
+    def is_done(self, repo: str, max_retries: int) -> bool:
+        """A repo is done once it succeeded or used every attempt it was allowed."""
+        finished = self.finished.get(repo)
+        if finished is None:
+            return False
+        return bool(finished["success"]) or self.attempts[repo] > max_retries
+
+    def take_pending(self, repo: str) -> list:
+        """
+        Return the States of the repo's interrupted attempt, once. Later attempts of the repo in
+        this process (scheduler retries) start fresh.
+        """
+        with self._lock:
+            events = self.pending.pop(repo, None) or []
+        return [State.from_dict(event["state"], event["agent"]) for event in events]
+
+    def start(self, repo: str, resumed=False):
+        self._append({"event": "start", "repo": repo, "attempt": self.attempts[repo], "resumed": resumed, "time": time.time()})
+
+    def record_state(self, repo: str, state: State):
+        self._append({"event": "state", "repo": repo, "agent": state.action.agent_name, "state": state.to_dict(), "time": time.time()})
+
+    def finish(self, repo: str, success: bool, record: str):
+        with self._lock:
+            self.attempts[repo] += 1
+            attempt = self.attempts[repo]
+        self._append({"event": "finish", "repo": repo, "attempt": attempt - 1, "success": success, "record": record, "time": time.time()})
+
+    def close(self):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
@@ -1,19 +1,99 @@
 import pexpect
+from collections import deque
+from output_sanitizer import OutputSanitizer
+from executor_base import ExecutorBase
 from state import *
+import uuid
+import time
+import os
 import re
 
-class CommandExecutor:
+class BoundedCapture:
+    """
+    Keeps the first `head_chars` and the last `tail_chars` of cleaned output lines in memory.
+    Lines in between are only counted; the full stream lives in the command's raw log file.
+    """
+
+    def __init__(self, head_chars=20000, tail_chars=50000):
+        self.head_chars = head_chars
+        self.tail_chars = tail_chars
+        self.head = []
+        self.head_len = 0
+        self.tail = deque()
+        self.tail_len = 0
+        self.dropped_lines = 0
+
+    def write(self, text: str):
+        if not text:
+            return
+        for line in text.split("\n"):
+            if self.head_len < self.head_chars:
+                self.head.append(line)
+                self.head_len += len(line) + 1
+                continue
+            self.tail.append(line)
+            self.tail_len += len(line) + 1
+            while self.tail_len > self.tail_chars and len(self.tail) > 1:
+                self.tail_len -= len(self.tail.popleft()) + 1
+                self.dropped_lines += 1
+
+    @property
+    def truncated(self) -> bool:
+        return self.dropped_lines > 0
+
+    def getvalue(self) -> str:
+        lines = list(self.head)
+        if self.dropped_lines:
+            lines.append(f"... [{self.dropped_lines} lines omitted] ...")
+        lines.extend(self.tail)
+        return "\n".join(lines)
+
+class CommandExecutor(ExecutorBase):
     """
     Executes commands in an already running Docker container using pexpect.
     Captures stdout, stderr, and exit code.
     """
 
-    def __init__(self, container_name: str, timeout=900):
+    def __init__(self, container_name: str, timeout=900, max_output_chars=None,
+                 stream_output=False, log_dir=None, head_chars=20000, tail_chars=50000, chunk_size=65536,
+                 idle_timeout=600, progress_callback=None, progress_interval=5, protocol="nonce",
+                 drop_prompts=True):
         self.container_name = container_name
         self.timeout = timeout
-        
-        cmd = f"docker exec -it {container_name} /bin/bash"
-        self.child = pexpect.spawn(cmd, encoding='utf-8', timeout=timeout, echo=False)
+        # "nonce": frame each command's output with unique markers (one round-trip per command)
+        # "sync":  echo a sync line and wait for the prompt before every command
+        if protocol not in ("nonce", "sync"):
+            raise ValueError(f"Unknown protocol {protocol!r}")
+        self.protocol = protocol
+        # Kill a command after this many seconds without output (None disables the watchdog)
+        self.idle_timeout = idle_timeout
+        # Called as progress_callback(command, bytes_read, bytes_per_sec, elapsed) while a command runs
+        self.progress_callback = progress_callback
+        self.progress_interval = progress_interval
+        # Keep only the tail of very long outputs (None keeps everything)
+        self.max_output_chars = max_output_chars
+        # Drop lines that are only shell prompts (e.g. bash "> " continuations) from cleaned output
+        self.drop_prompts = drop_prompts
+
+        # Streaming capture: raw output is spilled to a per-command log file in `log_dir` (kept after
+        # close, since BashOutput.log_path points there) and only a bounded head/tail of the cleaned
+        # output is kept in memory
+        self.stream_output = stream_output
+        self.head_chars = head_chars
+        self.tail_chars = tail_chars
+        self.chunk_size = chunk_size
+        self.log_dir = os.path.abspath(log_dir or os.path.join("./logs/raw", container_name))
+        self._command_count = 0
+        if self.stream_output:
+            os.makedirs(self.log_dir, exist_ok=True)
+
+        self._spawn()
+
+    def _spawn(self):
+        cmd = f"docker exec -it {self.container_name} /bin/bash"
+        self.child = pexpect.spawn(cmd, encoding='utf-8', timeout=self.timeout, echo=False)
+        # pexpect sleeps 50ms before every send by default; nothing here needs it
+        self.child.delaybeforesend = None
         self._set_prompt()
 
     def _set_prompt(self):
@@ -34,65 +114,224 @@ class CommandExecutor:
         self._prompt_exact = self.prompt
         self._prompt_regex = prompt_escaped
 
+    _exit_marker_regex = re.compile(r"__EXIT__MARKER__(\d+)__EXIT__MARKER__")
+
     def _flush_until_prompt(self):
         """Ensure buffer is clean before starting a new command."""
         self.child.sendline('echo __SYNC__')
         self.child.expect_exact('__SYNC__')
         self.child.expect_exact(self._prompt_exact)
 
-    def execute(self, action):
+    def _interrupt(self):
+        """
+        Ctrl-C the running command and resync so the session stays usable.
+        A unique marker is queued behind the interrupt; seeing it printed proves the shell is
+        back at its prompt (a stale prompt already in the pipe would not).
+        Returns whatever the command printed meanwhile. If the shell doesn't come back,
+        start a new session (the working directory is lost).
+        """
+        output = ""
+        for _ in range(5):
+            nonce = uuid.uuid4().hex
+            self.child.sendintr()
+            self.child.sendline(f"printf '__CMD_SYNC_%s__\\n' {nonce}")
+            try:
+                self.child.expect_exact(f"__CMD_SYNC_{nonce}__", timeout=3)
+                return self.child.before.replace(self._prompt_exact, "")
+            except pexpect.TIMEOUT:
+                # e.g. a shell loop that survives its child's SIGINT; interrupt again.
+                # Unmatched output stays in pexpect's buffer and is returned with the next match
+                output = self.child.before
+            except pexpect.EOF:
+                output = self.child.before
+                break
+
+        print(f"Shell in {self.container_name} did not recover after Ctrl-C, restarting session")
+        self.child.close(force=True)
+        self._spawn()
+        return output.replace(self._prompt_exact, "")
+
+    def _iter_output(self, watchdog, nonce=None):
+        """
+        Yield raw output chunks until the command finishes.
+
+        Without a nonce the command ends when the prompt comes back (the prompt is not yielded).
+        With a nonce the output is framed by __CMD_BEGIN_<nonce>__ / __CMD_END_<nonce>_<code>__:
+        anything before the begin marker is leftover from earlier commands and is discarded,
+        the end marker carries the exit code (stored in `self._exit_code`), and whatever follows
+        it (normally just the prompt) is left for the next command to discard.
+
+        If the watchdog's budget runs out, the command is interrupted and `self._killed` is set
+        to the reason; the output flushed by the interrupt is still searched for the terminator.
+        """
+        self._killed = None
+        self._exit_code = None
+
+        if nonce is None:
+            begin = None
+            end = re.compile(re.escape(self._prompt_exact))
+            hold = len(self._prompt_exact) - 1
+        else:
+            begin = f"__CMD_BEGIN_{nonce}__"
+            end = re.compile(rf"\r?\n?__CMD_END_{nonce}_(\d+)__\r?\n")
+            hold = len(f"__CMD_END_{nonce}_") + 8
+
+        # Anything pexpect already buffered past the last match belongs to this command
+        pending = self.child.buffer
+        self.child.buffer = ""
+
+        while True:
+            if begin is not None:
+                idx = pending.find(begin)
+                if idx == -1:
+                    pending = pending[-(len(begin) - 1):]
+                else:
+                    pending = pending[idx + len(begin):].lstrip("\r\n")
+                    begin = None
+
+            if begin is None:
+                match = end.search(pending)
+                if match is not None:
+                    yield pending[:match.start()]
+                    if match.groups():
+                        self._exit_code = int(match.group(1))
+                        self.child.buffer = pending[match.end():]
+                    return
+                # Hold back a possible partial terminator until the next chunk arrives
+                if len(pending) > hold:
+                    yield pending[:-hold]
+                    pending = pending[-hold:]
+
+            if self._killed:
+                # Interrupted and the command never reached its end marker
+                yield pending if begin is None else ""
+                return
+
+            self._killed = watchdog.check()
+            if self._killed:
+                # The command may have finished just before the interrupt; parse what it flushed
+                # like any other output so an end marker (and its exit code) isn't lost
+                pending += self._interrupt()
+                continue
+
+            try:
+                chunk = self.child.read_nonblocking(self.chunk_size, timeout=1)
+            except pexpect.TIMEOUT:
+                continue
+
+            watchdog.output(len(chunk.encode('utf-8', errors='replace')))
+            pending += chunk
+
+    def execute(self, action, timeout=None, idle_timeout=None) -> BashOutput:
         command = getattr(action, 'command', None)
         if not command:
-            return {"output": "", "exit_code": 1}
+            return BashOutput("", exit_code=1)
 
-        self._flush_until_prompt()
+        if self.protocol == "nonce":
+            # The markers are assembled by printf, so an echoed copy of this line can't match them
+            nonce = uuid.uuid4().hex
+            safe_command = (f"printf '__CMD_BEGIN_%s__\\n' {nonce}; {{\n{command}\n}}; "
+                            f"printf '\\n__CMD_END_%s_%d__\\n' {nonce} \"$?\"")
+        else:
+            nonce = None
+            self._flush_until_prompt()
 
-        marker = "__EXIT__MARKER__"
-        
-        # Send multi-line command safely
-        safe_command = f"{{\n{command}\n}}; printf '\\n{marker}%d{marker}\\n' \"$?\""
+            marker = "__EXIT__MARKER__"
+
+            # Send multi-line command safely
+            safe_command = f"{{\n{command}\n}}; printf '\\n{marker}%d{marker}\\n' \"$?\""
 
+        start_time = time.monotonic()
         self.child.sendline(safe_command)
-        self.child.expect_exact(self._prompt_exact)
+        chunks = self._iter_output(self._watchdog(command, start_time, timeout, idle_timeout), nonce=nonce)
+
+        if self.stream_output:
+            result = self._read_streaming(chunks, start_time)
+        else:
+            result = self._read_buffered(chunks, command, start_time)
+
+        if self._exit_code is not None:
+            result.exit_code = self._exit_code
+        # A command that printed its exit code before the interrupt landed finished on its own
+        if self._killed and result.exit_code is None:
+            self._mark_killed(result, self._killed)
+        return result
 
-        raw = self.child.before.strip("\r\n")
+    def _read_buffered(self, chunks, command: str, start_time: float) -> BashOutput:
+        raw = "".join(chunks)
+        wall_time = time.monotonic() - start_time
+
+        raw = raw.strip("\r\n")
+        raw_bytes = len(raw.encode('utf-8', errors='replace'))
 
         # Remove the echoed command if needed
         if raw.startswith(command):
             raw = raw[len(command):].lstrip()
 
-        # Find exit code marker
-        start = raw.rfind(marker)
-        end = raw.rfind(marker, start + len(marker)) if start != -1 else -1
-
+        # Find the last exit code marker (terminal control codes may follow it)
         output = raw
-        if start != -1 and end != -1 and end > start:
-            output = raw[:start].rstrip("\r\n")
+        exit_code = None
+        match = None
+        for match in self._exit_marker_regex.finditer(raw):
+            pass
+        if match is not None:
+            output = raw[:match.start()].rstrip("\r\n")
+            exit_code = int(match.group(1))
         
         clean_output = self._clean_output(output)
-        # print(clean_output)
-        return clean_output
+
+        truncated = False
+        if self.max_output_chars is not None and len(clean_output) > self.max_output_chars:
+            clean_output = clean_output[-self.max_output_chars:]
+            truncated = True
+
+        return BashOutput(
+            clean_output,
+            exit_code=exit_code,
+            wall_time=wall_time,
+            raw_bytes=raw_bytes,
+            output_bytes=len(clean_output.encode('utf-8', errors='replace')),
+            truncated=truncated
+        )
+
+    def _read_streaming(self, chunks, start_time: float) -> BashOutput:
+        """Clean the command's output chunk by chunk, spilling the raw stream to a log file."""
+        self._command_count += 1
+        log_path = os.path.join(self.log_dir, f"cmd_{self._command_count:05d}.log")
+        capture = BoundedCapture(self.head_chars, self.tail_chars)
+
+        sanitizer = self._sanitizer()
+        raw_bytes = 0
+
+        with open(log_path, "w", encoding="utf-8", errors="replace") as log:
+            for chunk in chunks:
+                log.write(chunk)
+                raw_bytes += len(chunk.encode('utf-8', errors='replace'))
+                capture.write(sanitizer.feed(chunk))
+            capture.write(sanitizer.flush())
+        exit_code = sanitizer.exit_code
+
+        output = capture.getvalue()
+        return BashOutput(
+            output,
+            exit_code=exit_code,
+            wall_time=time.monotonic() - start_time,
+            raw_bytes=raw_bytes,
+            output_bytes=len(output.encode('utf-8', errors='replace')),
+            truncated=capture.truncated,
+            log_path=log_path
+        )
+
+    def _sanitizer(self) -> OutputSanitizer:
+        # A progress bar that only ever rewrites with \r never ends its line; never keep more
+        # than one tail's worth of it
+        return OutputSanitizer(drop_prompts=self.drop_prompts, prompts=(self.prompt,), max_line_chars=self.tail_chars)
 
     def _clean_output(self, text: str) -> str:
-        # remove exit markers
-        text = re.sub(r"__EXIT__MARKER__\d+__EXIT__MARKER__", "", text)
-        # remove ANSI escape sequences
-        text = re.sub(r"\x1B\[[0-?]*[ -/]*[@-~]", "", text)
-        # strip leading/trailing whitespace and collapse blank lines
-        lines = [line for line in text.splitlines() if line.strip()]
-
-        # handle carriage return progress bars: keep only last line after \r
-        cleaned_lines = []
-        for line in lines:
-            if "\r" in line:
-                line = line.split("\r")[-1]  # keep only final overwrite
-            if line.strip() and "> " not in line:
-                cleaned_lines.append(line)
-
-        return "\n".join(cleaned_lines)
+        return self._sanitizer().clean(text)
 
     def close(self):
-        """Close the pexpect child process."""
+        """Close the pexpect child process. Raw command logs are kept."""
         if self.child.isalive():
             self.child.sendline('exit')
             self.child.close()
@@ -0,0 +1,164 @@
+import subprocess
+import threading
+import shutil
+import queue
+import uuid
+import os
+
+
+class ContainerPool:
+    """
+    Keeps a set of pre-started, pre-warmed Docker containers ready to be leased by Environments.
+
+    On start-up a single container is created from `image_name`, the warmup commands are run in it,
+    and the result is committed as a snapshot image. Every pooled container is started from that
+    snapshot, so leasing one skips both container start-up and the bootstrap work.
+
+    A released container is never reused as-is: it is removed and a fresh container is started
+    from the snapshot in the background, which restores the pool to the clean snapshot state.
+
+    Containers can't gain new bind mounts after `docker run`, so every pooled container mounts its
+    own empty workspace directory (`workspace_path`, under `repos_root`) at /workspace. The leasing
+    Environment checks its repo out into that directory, so a container only ever sees its own repo.
+    """
+
+    def __init__(self, image_name="benchmark-image", size=4, repos_root="./data/CSRBench100",
+                 warmup_commands=None, cpus=None, memory=None):
+        self.image_name = image_name
+        self.size = size
+        self.repos_root = os.path.abspath(repos_root)
+        self.warmup_commands = warmup_commands or []
+        self.cpus = cpus
+        self.memory = memory
+
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._leased = set()
+        self._refills = []
+        self._closed = False
+
+        self.snapshot_image = self._build_snapshot()
+        for _ in range(self.size):
+            self._idle.put(self._start_container())
+
+    def _resource_args(self):
+        args = []
+        if self.cpus:
+            args += ["--cpus", str(self.cpus)]
+        if self.memory:
+            args += ["--memory", str(self.memory)]
+        return args
+
+    def _build_snapshot(self):
+        """Run the warmup commands once and commit the result as the pool's snapshot image."""
+        builder = f"benchmark_pool_builder_{uuid.uuid4().hex}"
+        snapshot = f"{self.image_name.split(':')[0]}:pool-{uuid.uuid4().hex[:12]}"
+
+        subprocess.run(["docker", "run", "-dit", "--name", builder, self.image_name, "/bin/bash"],
+                       check=True, stdout=subprocess.DEVNULL)
+        try:
+            for command in self.warmup_commands:
+                print(f"Warming pool snapshot: {command}")
+                subprocess.run(["docker", "exec", builder, "/bin/bash", "-lc", command], check=True)
+            subprocess.run(["docker", "commit", builder, snapshot], check=True, stdout=subprocess.DEVNULL)
+        finally:
+            subprocess.run(["docker", "rm", "-f", builder],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        print(f"Container pool snapshot committed as {snapshot}")
+        return snapshot
+
+    def workspace_path(self, container_name: str) -> str:
+        """Host directory mounted at /workspace in `container_name`."""
+        return os.path.join(self.repos_root, "_pool", container_name)
+
+    def _start_container(self):
+        container_name = f"benchmark_{uuid.uuid4().hex}"
+        workspace = self.workspace_path(container_name)
+        os.makedirs(workspace)
+        try:
+            subprocess.run([
+                "docker", "run", "-dit",
+                "--name", container_name,
+                *self._resource_args(),
+                "-v", f"{workspace}:/workspace",
+                self.snapshot_image, "/bin/bash"
+            ], check=True, stdout=subprocess.DEVNULL)
+        except subprocess.CalledProcessError:
+            self._discard(container_name)
+            raise
+        return container_name
+
+    def _refill(self):
+        try:
+            container_name = self._start_container()
+        except subprocess.CalledProcessError as e:
+            print(f"Failed to refill container pool: {e}")
+            return
+        with self._lock:
+            closed = self._closed
+        if closed:
+            self._discard(container_name)
+        else:
+            self._idle.put(container_name)
+
+    @staticmethod
+    def _remove(container_name):
+        subprocess.run(["docker", "rm", "-f", container_name],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def _discard(self, container_name):
+        """Remove a container that was never leased, together with its (empty) workspace directory."""
+        self._remove(container_name)
+        shutil.rmtree(self.workspace_path(container_name), ignore_errors=True)
+
+    def lease(self, timeout=None) -> str:
+        """Take an idle container from the pool, blocking until one is available."""
+        container_name = self._idle.get(timeout=timeout)
+        with self._lock:
+            self._leased.add(container_name)
+        return container_name
+
+    def release(self, container_name: str, keep=False):
+        """
+        Return a leased container. The dirty container is discarded (unless `keep`) and a fresh one
+        is started from the snapshot in the background, so the next lease doesn't wait on it.
+        Its workspace directory (the lessee's checkout) is left to the lessee.
+        """
+        with self._lock:
+            if container_name not in self._leased:
+                return
+            self._leased.discard(container_name)
+            closed = self._closed
+
+        if not keep:
+            self._remove(container_name)
+        if not closed:
+            t = threading.Thread(target=self._refill, daemon=True)
+            t.start()
+            with self._lock:
+                self._refills.append(t)
+
+    def close(self, remove_snapshot=True):
+        """Remove all idle containers and the snapshot image. Leased containers are left to their owners."""
+        with self._lock:
+            self._closed = True
+            refills = list(self._refills)
+        for t in refills:
+            t.join()
+
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+        if remove_snapshot:
+            subprocess.run(["docker", "rmi", "-f", self.snapshot_image],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,62 +1,349 @@
 import anthropic
+import asyncio
+import threading
+import random
 import os
 import time
 from dotenv import load_dotenv
 from state import *
+from response_cache import ResponseCache
 
 
 load_dotenv()
 api_key = os.getenv("ANTHROPIC_API_KEY")
-client = anthropic.Anthropic(api_key=api_key)
 
-class CoreAgent():
-    def __init__(self, model_id):
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 2
+BACKOFF_CAP = 60
+
+# Errors worth retrying: rate limits and network failures, plus any 5xx (see _is_retryable)
+RETRYABLE_ERRORS = (
+    anthropic.RateLimitError,
+    anthropic.APIConnectionError,
+)
+
+
+class LLMError(Exception):
+    """Raised when a request fails for good (not retryable, or out of attempts)."""
+
+
+def _is_retryable(error) -> bool:
+    # Overloaded (529), 503 and 504 subclass APIStatusError, not InternalServerError
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    return isinstance(error, anthropic.APIStatusError) and error.status_code >= 500
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by every agent in the process.
+    Agents run in different threads (and event loops), so waiting is computed under a lock
+    and the caller sleeps outside it.
+    """
+
+    def __init__(self, rate_per_minute=50, burst=None):
+        self.rate = rate_per_minute / 60
+        self.capacity = burst if burst is not None else max(1, rate_per_minute // 6)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self._lock = threading.Lock()
+
+    def configure(self, rate_per_minute, burst=None):
+        with self._lock:
+            self.rate = rate_per_minute / 60
+            self.capacity = burst if burst is not None else max(1, rate_per_minute // 6)
+            self.tokens = min(self.tokens, self.capacity)
+
+    def _reserve(self) -> float:
+        """Take a token and return how long the caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            return max(wait, self.paused_until - now)
+
+    def pause(self, seconds: float):
+        """Hold back every caller, e.g. after the server sends retry-after."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+rate_limiter = TokenBucket()
+
+# Opt-in on-disk response cache shared by every agent; see configure_cache()
+response_cache = None
+
+
+def configure_cache(path="./data/llm_cache.sqlite", mode="readwrite", ttl=7 * 24 * 3600, max_entries=100000):
+    global response_cache
+    response_cache = ResponseCache(path=path, mode=mode, ttl=ttl, max_entries=max_entries)
+    return response_cache
+
+
+# Provider-side prompt caching: breakpoints after the tools, the system prompt and the caller's
+# stable prompt prefix (3 of the 4 the API allows). Prefixes shorter than the model's minimum
+# cacheable length are simply not cached.
+prompt_caching = True
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def configure_prompt_caching(enabled: bool):
+    global prompt_caching
+    prompt_caching = enabled
+
+
+def _cached_system(system_prompt):
+    if not prompt_caching or not system_prompt:
+        return system_prompt
+    return [{"type": "text", "text": system_prompt, "cache_control": CACHE_CONTROL}]
+
+
+def _cached_tools(tools):
+    if not prompt_caching or not tools:
+        return tools
+    return tools[:-1] + [dict(tools[-1], cache_control=CACHE_CONTROL)]
+
+
+def _cached_messages(messages):
+    """Copy of a conversation with a cache breakpoint on its last block, so each turn reuses the previous prefix."""
+    if not prompt_caching or not messages:
+        return messages
+    last = messages[-1]
+    content = last["content"]
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    content = content[:-1] + [dict(content[-1], cache_control=CACHE_CONTROL)]
+    return messages[:-1] + [dict(last, content=content)]
+
+
+def _user_message(input_str, cache_prefix=None) -> dict:
+    """User message; a non-empty `cache_prefix` goes in its own block, ending in a cache breakpoint."""
+    if not cache_prefix:
+        return {"role": "user", "content": input_str}
+    prefix = {"type": "text", "text": cache_prefix}
+    if prompt_caching:
+        prefix["cache_control"] = CACHE_CONTROL
+    content = [prefix]
+    if input_str:
+        content.append({"type": "text", "text": input_str})
+    return {"role": "user", "content": content}
+
+
+def _retry_after(error) -> float:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _backoff_delay(attempt: int, error) -> float:
+    """Honour retry-after when the server sends it, otherwise full-jitter exponential backoff."""
+    retry_after = _retry_after(error)
+    if retry_after is not None:
+        return retry_after
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+class _EventLoopThread:
+    """
+    One background event loop that owns the shared AsyncAnthropic client.
+    httpx connection pools are bound to the loop they were created on, so all agents funnel
+    their requests through this loop to share one pool.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.loop = None
+        self.client = None
+
+    def start(self):
+        with self._lock:
+            if self.loop is not None:
+                return
+            self._start()
+
+    def _start(self):
+        ready = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            # max_retries=0: retries are handled here so they can share the rate limiter
+            self.client = anthropic.AsyncAnthropic(api_key=api_key, max_retries=0)
+            ready.set()
+            self.loop.run_forever()
+
+        threading.Thread(target=run, name="core-agent-loop", daemon=True).start()
+        ready.wait()
+
+    def run(self, coro):
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+
+_loop_thread = _EventLoopThread()
+
+
+def _new_usage() -> dict:
+    return {"requests": 0, "cached": 0, "input_tokens": 0, "output_tokens": 0,
+            "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}
+
+
+class AsyncCoreAgent():
+    def __init__(self, model_id, client=None, metrics=None, metrics_label=None):
         self.model_id = model_id
+        self._client = client
+        # Running totals for this agent; updated on the event loop thread only
+        self.usage = _new_usage()
+        # Optional metrics.MetricsRecorder that every call is reported to
+        self.metrics = metrics
+        self.metrics_label = metrics_label
 
-    def query(self, input_str, system_prompt):
-        user_message = {"role": "user", "content": input_str}
-        FAILURE_COUNTER = 0
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = anthropic.AsyncAnthropic(api_key=api_key, max_retries=0)
+        return self._client
 
-        while True:
-            try: 
-                response = client.messages.create(
-                    model=self.model_id,
-                    max_tokens=1000,
-                    temperature=1,
-                    system=system_prompt,
-                    messages=[user_message]
-                )
-                return response
-            
-            except Exception as e:
-                FAILURE_COUNTER += 1
-                if FAILURE_COUNTER >= 5:
-                    return "Error: Failed to get a response after multiple attempts."
-                print(f'Exception encountered: {e}. Retrying in 60 seconds...')
-                time.sleep(60)
+    def _record(self, started: float, start_time: float, latency: float, usage=None, cached=False, attempts=1, error=None):
+        if self.metrics is not None:
+            self.metrics.record_llm_call(self.metrics_label or self.model_id, self.model_id, start_time, latency,
+                                         time.monotonic() - started, usage=usage, cached=cached,
+                                         attempts=attempts, error=error)
 
-    def query_tools(self, input_str, tools, system_prompt):
-        user_message = {"role": "user", "content": input_str}
-        FAILURE_COUNTER = 0
+    async def _create(self, **kwargs):
+        started, start_time = time.monotonic(), time.time()
+        cache = response_cache
+        key = None
+        if cache is not None:
+            key = ResponseCache.key(**kwargs)
+            cached = cache.get(key)
+            if cached is not None:
+                self.usage["cached"] += 1
+                response = anthropic.types.Message.model_validate_json(cached)
+                self._record(started, start_time, time.monotonic() - started, response.usage, cached=True, attempts=0)
+                return response
 
+        attempt = 0
         while True:
-            try: 
-                response = client.messages.create(
-                    model=self.model_id,
-                    max_tokens=1000,
-                    temperature=1,
-                    tools=tools,
-                    system=system_prompt,
-                    messages=[user_message]
-                )
+            await rate_limiter.acquire()
+            call_started = time.monotonic()
+            try:
+                response = await self.client.messages.create(**kwargs)
+                latency = time.monotonic() - call_started
+                self.usage["requests"] += 1
+                for key_name in ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens"):
+                    self.usage[key_name] += getattr(response.usage, key_name, 0) or 0
+                if cache is not None:
+                    cache.put(key, self.model_id, response.model_dump_json())
+                self._record(started, start_time, latency, response.usage, attempts=attempt + 1)
                 return response
-            
+
             except Exception as e:
-                FAILURE_COUNTER += 1
-                if FAILURE_COUNTER >= 5:
-                    return "Error: Failed to get a response after multiple attempts."
-                print(f'Exception encountered: {e}. Retrying in 60 seconds...')
-                time.sleep(60)
+                attempt += 1
+                if not _is_retryable(e):
+                    print(f'Exception encountered: {e}. Not retrying.')
+                    self._record(started, start_time, time.monotonic() - call_started, attempts=attempt, error=str(e))
+                    raise LLMError(str(e)) from e
+                if attempt >= MAX_ATTEMPTS:
+                    self._record(started, start_time, time.monotonic() - call_started, attempts=attempt, error=str(e))
+                    raise LLMError(f"Failed to get a response after {attempt} attempts: {e}") from e
+                delay = _backoff_delay(attempt, e)
+                if isinstance(e, anthropic.RateLimitError):
+                    rate_limiter.pause(delay)
+                print(f'Exception encountered: {e}. Retrying in {delay:.1f} seconds...')
+                await asyncio.sleep(delay)
+
+    async def query(self, input_str, system_prompt, cache_prefix=None):
+        user_message = _user_message(input_str, cache_prefix)
+        return await self._create(
+            model=self.model_id,
+            max_tokens=1000,
+            temperature=1,
+            system=_cached_system(system_prompt),
+            messages=[user_message]
+        )
+
+    async def query_tools(self, input_str, tools, system_prompt, cache_prefix=None):
+        user_message = _user_message(input_str, cache_prefix)
+        return await self._create(
+            model=self.model_id,
+            max_tokens=1000,
+            temperature=1,
+            tools=_cached_tools(tools),
+            system=_cached_system(system_prompt),
+            messages=[user_message]
+        )
+
+    async def query_messages(self, messages, tools, system_prompt, max_tokens=2000):
+        """One turn of a multi-turn conversation; `messages` must hold plain JSON-serializable dicts."""
+        return await self._create(
+            model=self.model_id,
+            max_tokens=max_tokens,
+            temperature=1,
+            tools=_cached_tools(tools),
+            system=_cached_system(system_prompt),
+            messages=_cached_messages(messages)
+        )
+
+
+class CoreAgent():
+    """
+    Synchronous wrapper around AsyncCoreAgent. Every instance shares one background event loop,
+    one pooled HTTP client and the module-level rate limiter.
+    """
+
+    def __init__(self, model_id):
+        self.model_id = model_id
+        self._async_agent = None
+        self.metrics = None
+        self.metrics_label = None
+
+    @property
+    def async_agent(self) -> AsyncCoreAgent:
+        if self._async_agent is None:
+            _loop_thread.start()
+            self._async_agent = AsyncCoreAgent(self.model_id, client=_loop_thread.client,
+                                               metrics=self.metrics, metrics_label=self.metrics_label)
+        return self._async_agent
+
+    def attach_metrics(self, recorder, label: str):
+        """Report this agent's calls (latency, tokens, cost) to a metrics.MetricsRecorder under `label`."""
+        self.metrics, self.metrics_label = recorder, label
+        if self._async_agent is not None:
+            self._async_agent.metrics, self._async_agent.metrics_label = recorder, label
+
+    @property
+    def usage(self) -> dict:
+        """Requests and tokens (including prompt cache reads/writes) used by this agent so far."""
+        if self._async_agent is None:
+            return _new_usage()
+        return dict(self._async_agent.usage)
+
+    def query(self, input_str, system_prompt, cache_prefix=None):
+        """`cache_prefix` is prompt text sent before `input_str` that stays the same across calls."""
+        return _loop_thread.run(self.async_agent.query(input_str=input_str, system_prompt=system_prompt,
+                                                       cache_prefix=cache_prefix))
+
+    def query_tools(self, input_str, tools, system_prompt, cache_prefix=None):
+        return _loop_thread.run(self.async_agent.query_tools(input_str=input_str, tools=tools, system_prompt=system_prompt,
+                                                             cache_prefix=cache_prefix))
+
+    def query_messages(self, messages, tools, system_prompt, max_tokens=2000):
+        return _loop_thread.run(self.async_agent.query_messages(messages=messages, tools=tools, system_prompt=system_prompt,
+                                                                max_tokens=max_tokens))
 
 
 # Example usage
@@ -64,7 +351,7 @@ if __name__ == "__main__":
     agent = CoreAgent(model_id="claude-sonnet-4-20250514")
 
     # Normal LLM Query
-    response = agent.query(system_prompt="You are a helpful chatbot that should answer inquiries politely and sincerely.", 
+    response = agent.query(system_prompt="You are a helpful chatbot that should answer inquiries politely and sincerely.",
                            input_str="List all the python files in the current directory.")
     print(response.content[0].text)
 
@@ -85,4 +372,3 @@ if __name__ == "__main__":
     action = Action(command=command, description=text)
     print(action)
 
-    
\ No newline at end of file
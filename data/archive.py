@@ -0,0 +1,126 @@
+import os
+import stat
+import shutil
+import hashlib
+import zipfile
+import requests
+
+# Large chunks keep the per-chunk overhead negligible on multi-GB archives
+CHUNK_SIZE = 1 << 20
+
+
+class DownloadError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status    # HTTP status code, when the server answered
+
+    @property
+    def retryable(self) -> bool:
+        return self.status is None or self.status == 429 or self.status >= 500
+
+
+def download_file(url, dest, session=None, chunk_size=CHUNK_SIZE, sha256=None, timeout=60):
+    """
+    Stream `url` to `dest` without holding it in memory. The body is written to `dest.part`
+    and renamed into place only once it is complete, so a partial file is never mistaken for a
+    finished one. Checks Content-Length (when the body isn't re-encoded) and, if given, the
+    expected `sha256`. Returns (size, sha256 hex digest); raises DownloadError on failure.
+    """
+    part = dest + ".part"
+    os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with (session or requests).get(url, stream=True, timeout=timeout) as response:
+            if response.status_code != 200:
+                raise DownloadError(f"HTTP Status Code: {response.status_code}", status=response.status_code)
+            expected = response.headers.get("Content-Length")
+            if response.headers.get("Content-Encoding"):
+                expected = None     # iter_content decodes, so the length would not match
+            with open(part, "wb") as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+        if expected is not None and size != int(expected):
+            raise DownloadError(f"truncated download: {size} of {expected} bytes")
+        if sha256 is not None and digest.hexdigest() != sha256:
+            raise DownloadError(f"sha256 mismatch: got {digest.hexdigest()}, expected {sha256}")
+        os.replace(part, dest)
+    except requests.RequestException as e:
+        raise DownloadError(str(e)) from e
+    finally:
+        if os.path.exists(part):
+            os.remove(part)
+    return size, digest.hexdigest()
+
+
+def _common_top_level(names) -> bool:
+    """True if every member lives under one top-level directory (e.g. GitHub's `<repo>-<ref>/`)."""
+    tops = {name.split("/", 1)[0] for name in names}
+    return len(tops) == 1 and all("/" in name for name in names)
+
+
+def extract_zip(zip_path, target_dir, strip_top_level=True):
+    """
+    Extract `zip_path` into `target_dir`, dropping the archive's single top-level directory on
+    the fly when `strip_top_level` is set. Every member path is checked before anything is
+    written, and members are extracted into a sibling `<target_dir>.extracting` directory whose
+    entries are renamed into place only once all of them are complete, so a failure never leaves
+    a partial tree in `target_dir`. Members are streamed in large chunks and their CRCs are
+    checked as they are read; unsafe paths and corrupt members raise DownloadError. Executable
+    bits are kept. Returns the number of files.
+    """
+    staging = target_dir.rstrip("/") + ".extracting"
+    shutil.rmtree(staging, ignore_errors=True)
+    try:
+        with zipfile.ZipFile(zip_path) as z:
+            members = z.infolist()
+            strip = 1 if strip_top_level and _common_top_level([m.filename for m in members]) else 0
+            plan = []
+            for member in members:
+                parts = [part for part in member.filename.split("/") if part not in ("", ".")][strip:]
+                if not parts:
+                    continue
+                if ".." in parts:
+                    raise DownloadError(f"unsafe path in archive: {member.filename}")
+                plan.append((member, parts))
+
+            root = os.path.realpath(staging)
+            files = 0
+            for member, parts in plan:
+                path = os.path.join(root, *parts)
+                if member.is_dir():
+                    os.makedirs(path, exist_ok=True)
+                    continue
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with z.open(member) as src, open(path, "wb") as dst:
+                    shutil.copyfileobj(src, dst, CHUNK_SIZE)
+                mode = member.external_attr >> 16
+                if mode & 0o111 and not stat.S_ISLNK(mode):
+                    os.chmod(path, mode & 0o777)
+                files += 1
+
+        os.makedirs(target_dir, exist_ok=True)
+        if os.path.isdir(staging):
+            for name in os.listdir(staging):
+                os.replace(os.path.join(staging, name), os.path.join(target_dir, name))
+        return files
+    except zipfile.BadZipFile as e:
+        raise DownloadError(f"corrupt archive {zip_path}: {e}") from e
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def download_and_extract(url, target_dir, session=None, zip_path=None, keep_zip=False, strip_top_level=True, sha256=None):
+    """
+    Download a zip archive to disk and extract it into `target_dir`.
+    The archive goes to `zip_path` (default: `<target_dir>.zip`) and is removed afterwards unless `keep_zip`.
+    """
+    zip_path = zip_path or target_dir.rstrip("/") + ".zip"
+    try:
+        download_file(url, zip_path, session=session, sha256=sha256)
+        return extract_zip(zip_path, target_dir, strip_top_level=strip_top_level)
+    finally:
+        if not keep_zip and os.path.exists(zip_path):
+            os.remove(zip_path)
@@ -1,112 +1,109 @@
 import os
-import requests
-import zipfile
-import io
 import json
 import shutil
-import time
-
-def get_repo_metadata(user_repo):
-    api_url = f"https://api.github.com/repos/{user_repo}"
-    headers = {'Accept': 'application/vnd.github.v3+json'}
-    response = requests.get(api_url, headers=headers)
-    
-    if response.status_code == 200:
-        return response.json()
-    elif response.status_code == 404:
-        print(f"Repository not found: {user_repo}")
-    elif response.status_code == 403:
-        print(f"Rate limit exceeded for {user_repo}. Please try again later.")
-    else:
-        print(f"Failed to get metadata for {user_repo}. HTTP Status Code: {response.status_code}")
-    
-    return None
-
-def download_and_extract_zip(url, extract_to):
-    response = requests.get(url)
-    if response.status_code == 200:
-        with zipfile.ZipFile(io.BytesIO(response.content)) as z:
-            temp_dir = extract_to + "_temp"
-            z.extractall(temp_dir)
-            
-            # Move files from temp_dir to extract_to
-            for item in os.listdir(temp_dir):
-                s = os.path.join(temp_dir, item)
-                d = os.path.join(extract_to, item)
-                if os.path.isdir(s):
-                    for sub_item in os.listdir(s):
-                        sub_s = os.path.join(s, sub_item)
-                        sub_d = os.path.join(extract_to, sub_item)
-                        shutil.move(sub_s, sub_d)
-                else:
-                    shutil.move(s, extract_to)
-            shutil.rmtree(temp_dir)
-            
-        print(f"Downloaded and extracted {url} to {extract_to}")
+from concurrent.futures import ThreadPoolExecutor
+from github_client import GitHubClient, Manifest
+from archive import download_and_extract, DownloadError
+
+def get_repo_metadata(user_repo, client: GitHubClient):
+    # Revalidated with the ETag from earlier runs, so unchanged repos don't use the rate limit
+    return client.get_json(f"/repos/{user_repo}")
+
+def download_and_extract_zip(url, extract_to, session=None):
+    # Streamed to disk and extracted straight into extract_to, without the archive's top-level directory
+    try:
+        files = download_and_extract(url, extract_to, session=session)
+    except DownloadError as e:
+        print(f"Failed to download {url}. {e}")
+        return False
+    print(f"Downloaded and extracted {url} to {extract_to} ({files} files)")
+    return True
+
+
+def get_latest_commit_id(repo_url, default_branch, client: GitHubClient):
+    user_repo = repo_url.rstrip('/').replace('https://github.com/', '')
+    data = client.get_json(f"/repos/{user_repo}/commits/{default_branch}")
+    if data:
+        return data['sha']
     else:
-        print(f"Failed to download {url}. HTTP Status Code: {response.status_code}")
+        print(f"Failed to fetch commit ID for {repo_url}.")
+        return None
 
 
+def download_github_repo(link, folder, client: GitHubClient, manifest: Manifest):
+    """Fetch one repo's metadata, commit ID and archive; returns its manifest entry or None."""
+    user_repo = link.rstrip('/').replace('https://github.com/', '')
+    repo_name = user_repo.split('/')[-1]
+    extract_to = os.path.join(folder, repo_name)
 
+    entry = manifest.get(link)
+    if entry and entry.get('status') == 'done' and os.path.isdir(extract_to):
+        print(f"Skipping {user_repo}: already downloaded at {entry['commit_id']}")
+        return entry
 
-def get_latest_commit_id(repo_url, default_branch):
-    # api_url = repo_url.replace("https://github.com", "https://api.github.com/repos") + "/commits/main"
-    api_url = repo_url.replace("https://github.com", "https://api.github.com/repos") + f"/commits/{default_branch}"
-    response = requests.get(api_url)
-    if response.status_code == 200:
-        data = response.json()
-        return data['sha']
-    else:
-        print(f"Failed to fetch commit ID for {repo_url}. HTTP Status Code: {response.status_code}")
+    metadata = get_repo_metadata(user_repo, client)
+    if not metadata:
+        manifest.update(link, status='failed')
+        return None
+    default_branch = metadata.get('default_branch', 'main')
+
+    # Fetching the commit ID first pins the archive to exactly that commit
+    commit_id = get_latest_commit_id(link, default_branch, client)
+    ref = commit_id if commit_id else f"refs/heads/{default_branch}"
+    zip_url = f"{client.web_url}/{user_repo}/archive/{ref}.zip"
+
+    if os.path.isdir(extract_to):
+        shutil.rmtree(extract_to)   # leftover of an interrupted download
+    os.makedirs(extract_to, exist_ok=True)
+    if not download_and_extract_zip(zip_url, extract_to, session=client.session) or not commit_id:
+        shutil.rmtree(extract_to, ignore_errors=True)
+        manifest.update(link, status='failed')
         return None
 
+    # Save metadata as JSON
+    metadata_file_path = os.path.join(extract_to, 'metadata.json')
+    with open(metadata_file_path, 'w') as json_file:
+        json.dump(metadata, json_file, indent=4)
+    print(f"Saved metadata for {user_repo} to {metadata_file_path}")
 
-def download_github_repos(file_path, folder):
+    manifest.update(link, status='done', commit_id=commit_id, default_branch=default_branch, path=extract_to)
+    return manifest.get(link)
+
+
+def download_github_repos(file_path, folder, workers=8, client=None,
+                          manifest_path='./meta/CSRBench100_download_manifest.json',
+                          commit_ids_path='./meta/CSRBench100_commit_ids.json'):
+    """
+    Download every repo listed in `file_path` into `folder` with `workers` threads sharing one
+    rate-limit-aware GitHubClient. Progress is kept in `manifest_path`, so a re-run skips repos
+    that were already downloaded.
+    """
     os.makedirs(folder, exist_ok=True)
-    
+    client = client or GitHubClient(pool_size=workers, etag_cache='./meta/github_etags.json')
+    manifest = Manifest(manifest_path)
+
     with open(file_path, 'r') as file:
-        links = file.readlines()
-
-    commit_ids = {}
-
-    for link in links:
-        link = link.strip()
-        if link:
-            user_repo = link.rstrip('/').replace('https://github.com/', '')
-            repo_name = user_repo.split('/')[-1]
-            
-            metadata = get_repo_metadata(user_repo)
-            if metadata:
-                default_branch = metadata.get('default_branch', 'main')
-                zip_url = f"https://github.com/{user_repo}/archive/refs/heads/{default_branch}.zip"
-                extract_to = os.path.join(folder, repo_name)
-                os.makedirs(extract_to, exist_ok=True)
-                
-                download_and_extract_zip(zip_url, extract_to)
-                
-                # Save metadata as JSON
-                metadata_file_path = os.path.join(extract_to, 'metadata.json')
-                with open(metadata_file_path, 'w') as json_file:
-                    json.dump(metadata, json_file, indent=4)
-                print(f"Saved metadata for {user_repo} to {metadata_file_path}")
-            
-            time.sleep(60)
-            # Fetching commit IDs and storing them in a dictionary
-            commit_id = get_latest_commit_id(link, default_branch)
-            if commit_id:
-                commit_ids[link] = (commit_id, default_branch)
-
-            time.sleep(60)
-
-    # Saving the dictionary as a JSON file
-    with open('./meta/CSRBench100_commit_ids.json', 'w') as file:
+        links = [link.strip() for link in file if link.strip()]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        entries = list(pool.map(lambda link: download_github_repo(link, folder, client, manifest), links))
+    client.save_etags()
+
+    # Saving the commit IDs (including ones from earlier runs) as a JSON file
+    commit_ids = {link: (entry['commit_id'], entry['default_branch']) for link, entry in zip(links, entries) if entry}
+    with open(commit_ids_path, 'w') as file:
         json.dump(commit_ids, file, indent=4)
 
+    failed = [link for link, entry in zip(links, entries) if not entry]
+    print(f"Downloaded {len(links) - len(failed)} / {len(links)} repos" + (f"; failed: {failed}" if failed else ""))
+    return commit_ids
+
 
-# Path to the text file containing the GitHub links
-file_path = './meta/CSRBench100.txt'
+if __name__ == "__main__":
+    # Path to the text file containing the GitHub links
+    file_path = './meta/CSRBench100.txt'
 
-# Target folder
-folder = '../data/CSRBench100/'
+    # Target folder
+    folder = '../data/CSRBench100/'
 
-download_github_repos(file_path, folder)
+    download_github_repos(file_path, folder)
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+API_URL = "https://api.github.com"
+WEB_URL = "https://github.com"
+
+
+class GitHubClient:
+    """
+    Thread-safe GitHub client shared by the scrapers.
+
+    - One requests.Session with a connection pool sized for `pool_size` concurrent workers.
+    - Follows X-RateLimit-Remaining/Reset: callers slow down as the budget runs low and wait for
+      the reset once it is spent, instead of sleeping a fixed time per request. Rate-limited
+      (403/429) and 5xx responses are retried.
+    - Conditional requests: GET responses with an ETag are remembered (optionally in the
+      `etag_cache` JSON file) and revalidated with If-None-Match; a 304 costs no rate limit.
+
+    `api_url` and `web_url` can point at a local stub server for testing.
+    Authenticates with `token` or $GITHUB_TOKEN when set.
+    """
+
+    def __init__(self, token=None, api_url=API_URL, web_url=WEB_URL, pool_size=16, etag_cache=None,
+                 max_retries=5, low_water=20, timeout=60):
+        self.api_url = api_url.rstrip("/")
+        self.web_url = web_url.rstrip("/")
+        self.max_retries = max_retries
+        self.low_water = low_water
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept"] = "application/vnd.github+json"
+        token = token or os.getenv("GITHUB_TOKEN")
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+
+        self.remaining = None
+        self.reset = 0
+        self.etag_cache = etag_cache
+        self._etags = {}
+        if etag_cache and os.path.exists(etag_cache):
+            with open(etag_cache) as f:
+                self._etags = json.load(f)
+        self._lock = threading.Lock()
+
+    def _url(self, path: str) -> str:
+        return path if path.startswith(("http://", "https://")) else f"{self.api_url}/{path.lstrip('/')}"
+
+    def _throttle(self):
+        with self._lock:
+            remaining, reset = self.remaining, self.reset
+        wait = reset - time.time()
+        if remaining is None or wait <= 0:
+            return
+        if remaining <= 0:
+            print(f"GitHub rate limit spent, waiting {wait:.0f}s for reset")
+            time.sleep(wait + 1)
+        elif remaining < self.low_water:
+            # Spread what is left of the budget over the rest of the window
+            time.sleep(wait / remaining)
+
+    def _update_rate_limit(self, response):
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset = response.headers.get("X-RateLimit-Reset")
+        if remaining is None or reset is None:
+            return
+        remaining, reset = int(remaining), float(reset)
+        with self._lock:
+            # Concurrent responses arrive out of order; within one window keep the lowest count
+            if reset != self.reset or self.remaining is None:
+                self.remaining, self.reset = remaining, reset
+            else:
+                self.remaining = min(self.remaining, remaining)
+
+    def _retry_delay(self, response, attempt: int):
+        """Seconds to wait before retrying `response`, or None if it should not be retried."""
+        if response.status_code in (403, 429):
+            retry_after = response.headers.get("Retry-After")
+            if retry_after is not None:
+                return float(retry_after)
+            if response.headers.get("X-RateLimit-Remaining") == "0":
+                return max(0, float(response.headers.get("X-RateLimit-Reset", 0)) - time.time()) + 1
+            return None
+        if response.status_code >= 500:
+            return random.uniform(0, min(60, 2 ** attempt))
+        return None
+
+    def get(self, path: str, params=None, headers=None, conditional=True, **kwargs) -> requests.Response:
+        """
+        GET an API path or full URL, with throttling and retries. With `conditional`, a remembered
+        ETag is sent and a 304 response is answered from the remembered body (see get_json/get_text).
+        """
+        url = self._url(path)
+        key = url + ("?" + json.dumps(params, sort_keys=True) if params else "")
+        for attempt in range(self.max_retries):
+            self._throttle()
+            request_headers = dict(headers or {})
+            cached = self._etags.get(key) if conditional else None
+            if cached is not None:
+                request_headers["If-None-Match"] = cached["etag"]
+            try:
+                response = self.session.get(url, params=params, headers=request_headers, timeout=self.timeout, **kwargs)
+            except requests.ConnectionError as e:
+                if attempt + 1 == self.max_retries:
+                    raise
+                print(f"Connection error for {url}: {e}. Retrying...")
+                time.sleep(random.uniform(0, min(60, 2 ** attempt)))
+                continue
+            self._update_rate_limit(response)
+
+            delay = self._retry_delay(response, attempt)
+            if delay is None or attempt + 1 == self.max_retries:
+                response.cache_key = key
+                return response
+            print(f"GitHub returned {response.status_code} for {url}, retrying in {delay:.0f}s")
+            response.close()
+            time.sleep(delay)
+
+    def get_text(self, path: str, params=None, headers=None, conditional=True):
+        """Body of a successful GET (revalidated via ETag), or None on failure."""
+        response = self.get(path, params=params, headers=headers, conditional=conditional)
+        if response.status_code == 304:
+            return self._etags[response.cache_key]["body"]
+        if response.status_code != 200:
+            print(f"Failed to fetch {response.url}. HTTP Status Code: {response.status_code}")
+            return None
+        etag = response.headers.get("ETag")
+        if conditional and etag:
+            with self._lock:
+                self._etags[response.cache_key] = {"etag": etag, "body": response.text}
+        return response.text
+
+    def get_json(self, path: str, params=None, headers=None, conditional=True):
+        text = self.get_text(path, params=params, headers=headers, conditional=conditional)
+        return json.loads(text) if text is not None else None
+
+    def save_etags(self):
+        if not self.etag_cache:
+            return
+        with self._lock:
+            data = json.dumps(self._etags)
+        _atomic_write(self.etag_cache, data)
+
+
+def _atomic_write(path: str, text: str):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+class Manifest:
+    """
+    Resumable progress file: a JSON object of {key: entry}, rewritten atomically on every update
+    so an interrupted scrape can skip what it already finished.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            return self.entries.get(key)
+
+    def update(self, key: str, **fields):
+        with self._lock:
+            self.entries[key] = dict(self.entries.get(key) or {}, **fields)
+            _atomic_write(self.path, json.dumps(self.entries, indent=4))
@@ -1,43 +1,70 @@
-import requests
+import os
 import json
+import requests
 from urllib.parse import urlparse
-import time
+from concurrent.futures import ThreadPoolExecutor
+from github_client import GitHubClient, Manifest
+
+ISSUES_DIR = './CSRBench100Issues'
+
+
+def fetch_comments(client: GitHubClient, issue):
+    """
+    All comments of an issue, following pagination. Raises RuntimeError if a page fails, so the
+    repo's `since` isn't advanced past an issue saved with missing comments.
+    """
+    if not issue.get('comments'):
+        return []   # the issue's comment count is already known; skip the request
+    comments = []
+    url, params = issue['comments_url'], {'per_page': 100}
+    while url:
+        response = client.get(url, params=params, conditional=False)
+        if response.status_code != 200:
+            raise RuntimeError(f"Failed to fetch comments for {issue['html_url']}: {response.status_code}")
+        comments.extend(response.json())
+        url, params = response.links.get('next', {}).get('url'), None
+    return comments
 
 
 # Function to fetch issues from a GitHub repository
-def fetch_github_issues(repo_owner, repo_name, state='closed', per_page=100):
-    issues = []
-    page = 1
-    while True:
-        url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/issues"
-        params = {
-            'state': state,
-            'per_page': per_page,
-            'page': page
-        }
-        response = requests.get(url, params=params)
+def fetch_github_issues(repo_owner, repo_name, client: GitHubClient, pool: ThreadPoolExecutor, state='closed', per_page=100, since=None):
+    """
+    Yield the repo's issues (pull requests excluded) with their comments attached, page by page.
+    Comments of a page are fetched concurrently on `pool`. With `since` (ISO 8601), only issues
+    updated at or after that time are returned.
+    """
+    url = f"/repos/{repo_owner}/{repo_name}/issues"
+    params = {'state': state, 'per_page': per_page, 'sort': 'updated', 'direction': 'asc'}
+    if since:
+        params['since'] = since
+    while url:
+        response = client.get(url, params=params, conditional=False)
         if response.status_code != 200:
-            print(f"Failed to fetch issues: {response.status_code}")
-            break
-        
-        page_issues = response.json()
-        if not page_issues:
-            break
-        
-        for issue in page_issues:
-            # Fetch comments for each issue
-            comments_url = issue['comments_url']
-            comments_response = requests.get(comments_url)
-            if comments_response.status_code == 200:
-                issue['comments'] = comments_response.json()
-            else:
-                issue['comments'] = []
-
-        page_issues = [issue for issue in page_issues if 'issues' in issue['html_url']]
-        issues.extend(page_issues)
-        page += 1
-    
-    return issues
+            raise RuntimeError(f"Failed to fetch issues: {response.status_code}")
+
+        # The issues endpoint also lists pull requests; drop them before fetching any comments
+        page_issues = [issue for issue in response.json() if 'pull_request' not in issue]
+        for issue, comments in zip(page_issues, pool.map(lambda issue: fetch_comments(client, issue), page_issues)):
+            issue['comments'] = comments
+            yield issue
+        url, params = response.links.get('next', {}).get('url'), None
+
+
+def _merge_jsonl(old_path, new_path, out_path):
+    """Write `new_path`'s issues plus the ones in `old_path` that weren't updated, to `out_path`."""
+    updated = set()
+    with open(out_path, 'w') as out:
+        with open(new_path) as f:
+            for line in f:
+                updated.add(json.loads(line)['number'])
+                out.write(line)
+        if os.path.exists(old_path):
+            with open(old_path) as f:
+                for line in f:
+                    if json.loads(line)['number'] not in updated:
+                        out.write(line)
+    return len(updated)
+
 
 # Function to parse repository owner and name from URL
 def parse_repo_url(repo_url):
@@ -50,26 +77,50 @@ def parse_repo_url(repo_url):
         raise ValueError("Invalid GitHub repository URL")
 
 # Main function to run the script
-def main(repo_url):
+def main(repo_url, client: GitHubClient, pool: ThreadPoolExecutor, manifest: Manifest, out_dir=ISSUES_DIR):
+    """
+    Harvest a repo's closed issues into `<out_dir>/<repo>.jsonl` (one issue per line).
+    Re-runs only fetch issues updated since the previous run and merge them into the file.
+    """
     try:
         repo_owner, repo_name = parse_repo_url(repo_url)
-        issues = fetch_github_issues(repo_owner, repo_name)
-        
-        # Save issues to a JSON file named after the repository
-        file_name = f"./CSRBench100Issues/{repo_name}.json"
-        with open(file_name, 'w') as f:
-            json.dump(issues, f, indent=4)
-        
-        print(f"Fetched {len(issues)} closed issues from {repo_owner}/{repo_name} and saved to {file_name}")
-    
     except ValueError as e:
         print(e)
+        return
+
+    entry = manifest.get(repo_url) or {}
+    file_name = os.path.join(out_dir, f"{repo_name}.jsonl")
+    since = entry.get('since') if os.path.exists(file_name) else None
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Issues are streamed to a .part file as they arrive, then merged into the repo's file
+    part_name = file_name + '.part'
+    latest = since
+    try:
+        with open(part_name, 'w') as f:
+            for issue in fetch_github_issues(repo_owner, repo_name, client, pool, since=since):
+                f.write(json.dumps(issue) + '\n')
+                latest = max(latest or '', issue['updated_at'])
+        count = _merge_jsonl(file_name, part_name, file_name + '.tmp')
+        os.replace(file_name + '.tmp', file_name)
+    except (RuntimeError, requests.RequestException) as e:
+        # Skip this repo; the next run retries it from the same `since`
+        print(f"{repo_owner}/{repo_name}: {e}")
+        return
+    finally:
+        if os.path.exists(part_name):
+            os.remove(part_name)
 
-    time.sleep(15)
+    manifest.update(repo_url, since=latest)
+    print(f"Fetched {count} {'updated ' if since else ''}closed issues from {repo_owner}/{repo_name} into {file_name}")
 
 
 # Example usage
 if __name__ == "__main__":
+    client = GitHubClient()
+    manifest = Manifest(os.path.join(ISSUES_DIR, 'manifest.json'))
     data = open('./meta/CSRBench100.txt', 'r').readlines()
-    for item in data:
-        main(item.strip())
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for item in data:
+            if item.strip():
+                main(item.strip(), client, pool, manifest)
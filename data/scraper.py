@@ -3,8 +3,12 @@ import requests
 import json
 import time
 import os
-from joblib import Parallel, delayed
+import shutil
+import hashlib
 import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from archive import download_file, extract_zip, DownloadError, CHUNK_SIZE
+from github_client import GitHubClient, Manifest, WEB_URL
 
 NAME = 'CSRBench100'
 
@@ -43,54 +47,130 @@ def fetch_data(name, per_page=50):
 # fetch_data(NAME, per_page=200)
 
 
-def download_repo_zip(name, max_repo=200, n_jobs=4):
-    def download_and_unzip_repo(repo, category_path):
-        full_name = repo['full_name']
-        default_branch = repo['default_branch']
-        save_path = os.path.join(category_path, f"{repo['full_name'].split('/')[-1]}.zip")
-
-        os.makedirs(os.path.dirname(save_path), exist_ok=True)
-
-        if not os.path.exists(save_path):
-            zip_url = f"https://github.com/{full_name}/archive/refs/heads/{default_branch}.zip"
-            response = requests.get(zip_url, stream=True)
-            if response.status_code == 200:
-                with open(save_path, 'wb') as file:
-                    for chunk in response.iter_content(chunk_size=256):
-                        file.write(chunk)
-                print(f"Downloaded {full_name} to {save_path}.")
-            else:
-                print(f"Failed to download {full_name}. Status code: {response.status_code}")
-                return  # Exit if download fails
-
-        unzip_directory = os.path.dirname(save_path)
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _link(src, dst):
+    """Hardlink dst to src, falling back to a symlink (e.g. across filesystems)."""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        os.symlink(os.path.abspath(src), dst)
+
+
+def download_repo_zip(name, max_repo=200, n_jobs=4, retries=3, session=None, web_url=WEB_URL):
+    """
+    Download and unzip the top `max_repo` repos of every category in ./data/{name}_meta_data.json.
+
+    The download plan is deduplicated across categories, so a repo listed under several topics is
+    fetched once. Archives live in a content-addressed store (./data/{name}/_zips/<sha256>.zip,
+    indexed by "<full_name>@<branch>") and are hardlinked, or symlinked, into each category as
+    <repo>.zip. One pool of `n_jobs` threads works through the whole plan, retrying failed downloads.
+    """
+    root = f'./data/{name}/'
+    store = os.path.join(root, '_zips')
+    index = Manifest(os.path.join(store, 'index.json'))
+    session = session or GitHubClient(pool_size=n_jobs).session
+
+    def build_plan(data):
+        plan = {}
+        for category, repos in data.items():
+            for repo in repos[:max_repo]:
+                key = f"{repo['full_name']}@{repo['default_branch']}"
+                plan.setdefault(key, (repo, []))[1].append(os.path.join(root, category))
+        return plan
+
+    def store_zip(key, path, sha256, size):
+        stored = os.path.join(store, f"{sha256}.zip")
+        if os.path.exists(stored):
+            os.remove(path)
+        else:
+            os.replace(path, stored)
+        index.update(key, sha256=sha256, size=size)
+        return stored
+
+    def fetch_zip(key, repo, category_paths):
+        """Path of the repo's archive in the store, downloading it only if no copy exists yet."""
+        entry = index.get(key)
+        if entry and os.path.exists(os.path.join(store, f"{entry['sha256']}.zip")):
+            return os.path.join(store, f"{entry['sha256']}.zip")
+
+        # Adopt an archive downloaded into a category folder by an earlier run
+        repo_name = repo['full_name'].split('/')[-1]
+        for category_path in category_paths:
+            save_path = os.path.join(category_path, f"{repo_name}.zip")
+            if os.path.isfile(save_path) and not os.path.islink(save_path) and zipfile.is_zipfile(save_path):
+                adopted = os.path.join(store, f"{hashlib.sha1(key.encode()).hexdigest()}.adopt")
+                shutil.copyfile(save_path, adopted)
+                return store_zip(key, adopted, _file_sha256(adopted), os.path.getsize(adopted))
+
+        zip_url = f"{web_url}/{repo['full_name']}/archive/refs/heads/{repo['default_branch']}.zip"
+        download_path = os.path.join(store, f"{hashlib.sha1(key.encode()).hexdigest()}.download")
+        for attempt in range(retries + 1):
+            try:
+                size, sha256 = download_file(zip_url, download_path, session=session)
+                return store_zip(key, download_path, sha256, size)
+            except DownloadError as e:
+                if attempt == retries or not e.retryable:
+                    raise
+                delay = 2 ** attempt
+                print(f"Download of {repo['full_name']} failed ({e}), retrying in {delay}s")
+                time.sleep(delay)
+
+    def unzip_repo(repo, zip_path, category_path):
+        repo_name = repo['full_name'].split('/')[-1]
+        save_path = os.path.join(category_path, f"{repo_name}.zip")
+        os.makedirs(category_path, exist_ok=True)
+        if not os.path.exists(save_path) or not os.path.samefile(save_path, zip_path):
+            _link(zip_path, save_path)
+
+        target_dir = os.path.join(category_path, repo_name)
         # Skip if the repository has already been unzipped
-        if os.path.exists(os.path.join(unzip_directory, full_name.split('/')[-1])):
-            print(f"{full_name} has already been unzipped.")
+        if os.path.exists(target_dir):
             return
 
-        repo_name = full_name.split('/')[-1]
-        target_dir = os.path.join(unzip_directory, repo_name)
-        
         try:
-            with zipfile.ZipFile(save_path, 'r') as zip_ref:
-                os.makedirs(target_dir, exist_ok=True)
-                zip_ref.extractall(target_dir)
-            print(f"Unzipped {save_path} into {target_dir}.")
+            # Keeps the archive's top-level <repo>-<branch>/ directory, as before
+            extract_zip(zip_path, target_dir, strip_top_level=False)
             json.dump(repo, open(os.path.join(target_dir, 'meta.json'), 'w'), indent=4)
 
-        except zipfile.BadZipFile:
-            print(f"Bad zip file: {save_path}")
-    
-    def download_repos_by_category(data, max_repo=max_repo, n_jobs=n_jobs):
-        for category, repos in data.items():
-            print(f"Processing category: {category}")
-            category_path = os.path.join(f'./data/{name}/', category)
-            tasks = (delayed(download_and_unzip_repo)(repo, category_path) for repo in repos[:max_repo])
-            Parallel(n_jobs=n_jobs)(tasks)
+        except DownloadError as e:
+            print(f"Bad zip file: {save_path} ({e})")
+            shutil.rmtree(target_dir, ignore_errors=True)
+
+    def download_and_unzip_repo(key, repo, category_paths):
+        try:
+            zip_path = fetch_zip(key, repo, category_paths)
+        except DownloadError as e:
+            print(f"Failed to download {repo['full_name']}. {e}")
+            return False
+        for category_path in category_paths:
+            unzip_repo(repo, zip_path, category_path)
+        return True
 
     data = json.load(open(f'./data/{name}_meta_data.json', 'r'))
-    download_repos_by_category(data)
+    plan = build_plan(data)
+    entries = sum(len(category_paths) for _, category_paths in plan.values())
+    print(f"Download plan: {len(plan)} unique repos for {entries} category entries")
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        futures = {pool.submit(download_and_unzip_repo, key, repo, category_paths): key
+                   for key, (repo, category_paths) in plan.items()}
+        for done, future in enumerate(as_completed(futures), start=1):
+            ok = future.result()
+            if not ok:
+                failed.append(futures[future])
+            print(f"[{done}/{len(plan)}] {futures[future]}: {'ok' if ok else 'failed'}")
+    print(f"Downloaded {len(plan) - len(failed)} / {len(plan)} repos" + (f"; failed: {failed}" if failed else ""))
+    return failed
 
 # Example usage
 # download_repo_zip(NAME, max_repo=200, n_jobs=4)
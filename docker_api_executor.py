@@ -0,0 +1,271 @@
+import http.client
+import codecs
+import select
+import socket
+import struct
+import json
+import time
+import os
+from command_executor import BoundedCapture
+from output_sanitizer import OutputSanitizer
+from executor_base import ExecutorBase
+from state import *
+
+
+class DockerAPIError(Exception):
+    pass
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection over the Docker Engine's unix socket."""
+
+    def __init__(self, socket_path, timeout=60):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+# Runs the command in a fresh non-interactive bash, restoring the working directory and exported
+# environment left by the previous command and saving them again afterwards
+SCRIPT_TEMPLATE = """__state={state_dir}
+mkdir -p "$__state"; echo $$ > "$__state/pid"
+[ -f "$__state/env" ] && . "$__state/env"
+cd "$(cat "$__state/cwd" 2>/dev/null || echo {workdir})" 2>/dev/null
+{{
+{command}
+}}
+__rc=$?
+pwd > "$__state/cwd"; export -p > "$__state/env"
+exit $__rc
+"""
+
+
+class DockerAPIExecutor(ExecutorBase):
+    """
+    Executes commands in an already running Docker container through the Docker Engine API.
+
+    Each command is its own exec instance without a TTY, so output arrives on the multiplexed
+    stdout/stderr stream with no prompt, echo or terminal escapes to scrub, and the exit code
+    comes straight from the exec inspect endpoint. The working directory and exported variables
+    are carried between commands through a state directory inside the container; shell functions
+    and aliases are not.
+
+    Same interface as CommandExecutor: execute(action) -> BashOutput, close().
+    """
+
+    STDOUT = 1
+    STDERR = 2
+
+    def __init__(self, container_name: str, timeout=900, max_output_chars=None,
+                 stream_output=False, log_dir=None, head_chars=20000, tail_chars=50000, chunk_size=65536,
+                 idle_timeout=600, progress_callback=None, progress_interval=5,
+                 socket_path=None, workdir="/workspace"):
+        self.container_name = container_name
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.progress_callback = progress_callback
+        self.progress_interval = progress_interval
+        self.max_output_chars = max_output_chars
+        self.workdir = workdir
+        self.state_dir = "/tmp/.cmd_executor_state"
+
+        self.stream_output = stream_output
+        self.head_chars = head_chars
+        self.tail_chars = tail_chars
+        self.chunk_size = chunk_size
+        self.log_dir = os.path.abspath(log_dir or os.path.join("./logs/raw", container_name))
+        self._command_count = 0
+        if self.stream_output:
+            os.makedirs(self.log_dir, exist_ok=True)
+
+        if socket_path is None:
+            docker_host = os.getenv("DOCKER_HOST", "unix:///var/run/docker.sock")
+            if not docker_host.startswith("unix://"):
+                raise DockerAPIError(f"Only unix socket DOCKER_HOST is supported, got {docker_host}")
+            socket_path = docker_host[len("unix://"):]
+        self.socket_path = socket_path
+        self._conn = _UnixHTTPConnection(self.socket_path)
+
+    def _request(self, method: str, path: str, body=None):
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {"Content-Type": "application/json"} if payload is not None else {}
+        try:
+            self._conn.request(method, path, body=payload, headers=headers)
+            response = self._conn.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            # Reconnect once if the kept-alive connection went stale
+            self._conn.close()
+            self._conn.request(method, path, body=payload, headers=headers)
+            response = self._conn.getresponse()
+            data = response.read()
+
+        if response.status >= 400:
+            raise DockerAPIError(f"{method} {path} failed with {response.status}: {data.decode(errors='replace')}")
+        return json.loads(data) if data else None
+
+    def _create_exec(self, cmd: list) -> str:
+        result = self._request("POST", f"/containers/{self.container_name}/exec", {
+            "AttachStdin": False,
+            "AttachStdout": True,
+            "AttachStderr": True,
+            "Tty": False,
+            "Cmd": cmd
+        })
+        return result["Id"]
+
+    def _start_exec(self, exec_id: str):
+        """Start an exec and return the hijacked socket plus any stream bytes read with the headers."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        body = json.dumps({"Detach": False, "Tty": False}).encode()
+        sock.sendall(
+            (f"POST /exec/{exec_id}/start HTTP/1.1\r\n"
+             "Host: docker\r\n"
+             "Content-Type: application/json\r\n"
+             f"Content-Length: {len(body)}\r\n"
+             "Connection: Upgrade\r\n"
+             "Upgrade: tcp\r\n"
+             "\r\n").encode() + body
+        )
+
+        buffer = b""
+        while b"\r\n\r\n" not in buffer:
+            data = sock.recv(4096)
+            if not data:
+                sock.close()
+                raise DockerAPIError(f"Connection closed while starting exec {exec_id}")
+            buffer += data
+        head, rest = buffer.split(b"\r\n\r\n", 1)
+        status = int(head.split(b" ", 2)[1])
+        if status not in (101, 200):
+            sock.close()
+            raise DockerAPIError(f"Starting exec {exec_id} failed with {status}: {rest.decode(errors='replace')}")
+        return sock, rest
+
+    def _exit_code(self, exec_id: str):
+        for _ in range(50):
+            info = self._request("GET", f"/exec/{exec_id}/json")
+            if not info.get("Running"):
+                return info.get("ExitCode")
+            time.sleep(0.1)
+        return None
+
+    def _signal(self, signal: str):
+        """Signal the running command's whole process group (it runs under setsid)."""
+        exec_id = self._create_exec(["/bin/bash", "-c", f'kill -{signal} -- -"$(cat {self.state_dir}/pid)" 2>/dev/null'])
+        sock, _ = self._start_exec(exec_id)
+        sock.close()
+
+    def _iter_frames(self, sock, buffer: bytes, watchdog):
+        """
+        Yield (stream, bytes) frames from a multiplexed exec stream until it closes.
+        Interrupts the command when the watchdog's budget runs out and sets `self._killed`.
+        """
+        self._killed = None
+        signalled = None
+        escalation = []
+
+        while True:
+            while len(buffer) >= 8:
+                stream, size = buffer[0], struct.unpack(">I", buffer[4:8])[0]
+                if len(buffer) < 8 + size:
+                    break
+                yield stream, buffer[8:8 + size]
+                buffer = buffer[8 + size:]
+
+            now = time.monotonic()
+            if not self._killed:
+                self._killed = watchdog.check()
+                if self._killed:
+                    escalation = [("INT", 0), ("TERM", 2), ("KILL", 5)]
+                    signalled = now
+            # Ctrl-C first; escalate if the process group ignores it
+            while escalation and now - signalled >= escalation[0][1]:
+                self._signal(escalation.pop(0)[0])
+
+            ready, _, _ = select.select([sock], [], [], 1)
+            if not ready:
+                continue
+            data = sock.recv(self.chunk_size)
+            if not data:
+                return
+            watchdog.output(len(data))
+            buffer += data
+
+    def execute(self, action, timeout=None, idle_timeout=None) -> BashOutput:
+        command = getattr(action, 'command', None)
+        if not command:
+            return BashOutput("", exit_code=1)
+
+        script = SCRIPT_TEMPLATE.format(state_dir=self.state_dir, workdir=self.workdir, command=command)
+        start_time = time.monotonic()
+        exec_id = self._create_exec(["setsid", "-w", "/bin/bash", "-c", script])
+        sock, buffer = self._start_exec(exec_id)
+        watchdog = self._watchdog(command, start_time, timeout, idle_timeout)
+
+        log = None
+        log_path = None
+        if self.stream_output:
+            self._command_count += 1
+            log_path = os.path.join(self.log_dir, f"cmd_{self._command_count:05d}.log")
+            log = open(log_path, "w", encoding="utf-8", errors="replace")
+            capture = BoundedCapture(self.head_chars, self.tail_chars)
+            # No TTY here, so there are no prompts to drop; the sanitizer still collapses \r progress
+            # bars and bounds a line that never ends
+            sanitizer = OutputSanitizer(drop_prompts=False, drop_blank=False, max_line_chars=self.tail_chars)
+        else:
+            parts = []
+
+        # stdout and stderr are merged in arrival order, as a terminal would show them
+        decoders = {self.STDOUT: codecs.getincrementaldecoder("utf-8")("replace"),
+                    self.STDERR: codecs.getincrementaldecoder("utf-8")("replace")}
+        raw_bytes = 0
+        try:
+            for stream, payload in self._iter_frames(sock, buffer, watchdog):
+                raw_bytes += len(payload)
+                text = decoders.get(stream, decoders[self.STDOUT]).decode(payload)
+                if log is None:
+                    parts.append(text)
+                    continue
+                log.write(text)
+                capture.write(sanitizer.feed(text))
+        finally:
+            sock.close()
+            if log is not None:
+                log.close()
+
+        exit_code = self._exit_code(exec_id)
+        wall_time = time.monotonic() - start_time
+
+        truncated = False
+        if log is not None:
+            capture.write(sanitizer.flush())
+            output = capture.getvalue()
+            truncated = capture.truncated
+        else:
+            output = "".join(parts).rstrip("\n")
+            if self.max_output_chars is not None and len(output) > self.max_output_chars:
+                output = output[-self.max_output_chars:]
+                truncated = True
+
+        result = BashOutput(
+            output,
+            exit_code=exit_code,
+            wall_time=wall_time,
+            raw_bytes=raw_bytes,
+            output_bytes=len(output.encode('utf-8', errors='replace')),
+            truncated=truncated,
+            log_path=log_path
+        )
+        if self._killed:
+            self._mark_killed(result, self._killed)
+        return result
+
+    def close(self):
+        """Close the API connection. Raw command logs are kept."""
+        self._conn.close()
@@ -1,13 +1,18 @@
 import subprocess
+import shutil
 import uuid
 import atexit
 from state import *
-from command_executor import CommandExecutor
+from command_executor import CommandExecutor, BoundedCapture
+from docker_api_executor import DockerAPIExecutor
+from executor_base import ExecutorBase
 from script_evaluator import ScriptEvaluator
+from history_log import HistoryLog, render_pretty
+from bench_scripts import read_test_script
+import time
 import os
-import json
-from datetime import datetime
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 class Environment:
     """
@@ -15,90 +20,217 @@ class Environment:
     Spawns an isolated container, executes commands, and tracks history.
     """
 
-    def __init__(self, repo_url: str, keep_repo=False, keep_docker=False, image_name="benchmark-image", timeout=900, verbose=False):
+    def __init__(self, repo_url: str, keep_repo=False, keep_docker=False, image_name="benchmark-image", timeout=900, verbose=False, cpus=None, memory=None, pool=None, repo_cache=None, commit_id=None, stream_output=False, idle_timeout=600, progress_callback=None, protocol="nonce", backend="pexpect", state_callback=None, log_dir="logs", run_id=None, metrics=None):
         self.verbose = verbose
         self.keep_docker = keep_docker
-        self.keep_repo = keep_repo # (TODO) UNUSED FOR NOW
+        self.keep_repo = keep_repo
+        self.pool = pool
+        self._closed = False
         
-        # Docker Container
-        self.container_name = f"benchmark_{uuid.uuid4().hex}"
+        # Docker Container (leased from a warm pool if one is given)
+        if self.pool is not None:
+            self.container_name = self.pool.lease()
+        else:
+            self.container_name = f"benchmark_{uuid.uuid4().hex}"
         print(f"Agent running in container {self.container_name}")
 
-        # Define repo path
+        # Define repo path (a pooled container already mounts its own workspace directory)
         self.REPO_NAME= repo_url.rsplit('/', 1)[-1]
         self.name = f"{self.REPO_NAME}_{self.container_name}"
-        self.repo_path = os.path.abspath(f"./data/CSRBench100/{self.name}/")
+        if self.pool is not None:
+            self.repo_path = self.pool.workspace_path(self.container_name)
+        else:
+            self.repo_path = os.path.abspath(f"./data/CSRBench100/{self.name}/")
 
-        # Pull the repo
-        subprocess.run(
-            ["git", "clone", repo_url, f"{self.repo_path}"],
-            check=True
-        )
-        print(f"Repo cloned successfully to {self.repo_path}")
+        # Anything failing from here on must not leak the container or the checkout
+        try:
+            # Pull the repo
+            if repo_cache is not None:
+                repo_cache.checkout(repo_url, self.repo_path, commit=commit_id)
+            else:
+                subprocess.run(
+                    ["git", "clone", repo_url, f"{self.repo_path}"],
+                    check=True
+                )
+            print(f"Repo cloned successfully to {self.repo_path}")
+
+            print(f"Agent environment root at {self.repo_path}")
 
-        print(f"Agent environment root at {self.repo_path}")
+            # Histories, written ahead to logs/<name>.jsonl as each command finishes
+            self.history = defaultdict(list)
+            self._log_index = {}    # id(state) -> index in its agent's history, for logging evaluations
+            self.history_log = HistoryLog(os.path.join(log_dir, f"{self.name}.jsonl"),
+                                          meta={"repo": repo_url, "environment": self.name, "run_id": run_id})
 
-        # Histories
-        self.history = defaultdict(list)
+            if self.pool is None:
+                # Per-container resource limits (e.g. cpus="4", memory="16g") so parallel slots don't starve each other
+                resource_args = []
+                if cpus:
+                    resource_args += ["--cpus", str(cpus)]
+                if memory:
+                    resource_args += ["--memory", str(memory)]
 
-        # Start the container
-        subprocess.run([
-            "docker", "run", "-dit",
-            "--name", self.container_name,
-            "-v", f"{self.repo_path}:/workspace",
-            image_name, "/bin/bash"
-        ], check=True)
+                # Start the container
+                subprocess.run([
+                    "docker", "run", "-dit",
+                    "--name", self.container_name,
+                    *resource_args,
+                    "-v", f"{self.repo_path}:/workspace",
+                    image_name, "/bin/bash"
+                ], check=True)
 
-        # Create executor tied to this container
-        self.executor = CommandExecutor(container_name=self.container_name, timeout=timeout)
-        self.evaluator = ScriptEvaluator()
+            # Create executor tied to this container
+            if progress_callback is None and verbose:
+                progress_callback = self._print_progress
+            # Raw per-command logs (with --stream-output) live next to the history log and are kept
+            raw_log_dir = os.path.join(log_dir, "raw", self.name)
+            if backend == "docker-api":
+                self.executor = DockerAPIExecutor(container_name=self.container_name, timeout=timeout, stream_output=stream_output,
+                                                  log_dir=raw_log_dir, idle_timeout=idle_timeout, progress_callback=progress_callback)
+            elif backend == "pexpect":
+                self.executor = CommandExecutor(container_name=self.container_name, timeout=timeout, stream_output=stream_output,
+                                                log_dir=raw_log_dir, idle_timeout=idle_timeout, progress_callback=progress_callback,
+                                                protocol=protocol)
+            else:
+                raise ValueError(f"Unknown executor backend {backend!r}")
+            self.evaluator = ScriptEvaluator()
+            # Optional metrics.MetricsRecorder for command timings and the evaluator's LLM calls
+            self.metrics = metrics
+            if self.metrics is not None:
+                self.metrics.attach(self.evaluator.LLM, self.evaluator.name)
+            # Called with every new State, e.g. to journal it for checkpoint/resume
+            self.state_callback = state_callback
+        except BaseException:
+            self.close()
+            raise
 
         # Ensure cleanup on interpreter exit
         atexit.register(self.close)
 
-    def execute(self, action: Action) -> State:
-        """Executes an action in the container and stores the resulting state."""
-        output = self.executor.execute(action)
-        state = State(action, output)
-        self.history[action.agent_name].append(state)
+    def _record(self, state: State, started: float, stage=None):
+        history = self.history[state.action.agent_name]
+        history.append(state)
+        self._log_index[id(state)] = len(history) - 1
+        ended = time.time()
+        self.history_log.append(state.action.agent_name, len(history) - 1, state, started, ended, stage=stage)
+        if self.metrics is not None:
+            self.metrics.record_command(state.action.agent_name, state.action.command, state.result, started, ended, stage=stage)
+
+    def execute(self, action: Action, timeout=None, idle_timeout=None, stage=None) -> State:
+        """Executes an action in the container and stores the resulting state (`stage` only tags the log)."""
+        started = time.time()
+        result = self.executor.execute(action, timeout=timeout, idle_timeout=idle_timeout)
+        state = State(action, result.output, result=result)
+        self._record(state, started, stage=stage)
+        if self.state_callback is not None:
+            self.state_callback(state)
         if self.verbose:
             print(state)
         return state
+
+    def execute_concurrent(self, actions: list, timeout=120, max_workers=4) -> list:
+        """
+        Run commands that don't change any state (e.g. `ls`, `cat`, `grep`) side by side, each in its
+        own `docker exec` in the shell's current directory, and store their states in order.
+        The shell session itself runs one command at a time, so it only runs an unrecorded `pwd` to read
+        that directory. The commands don't see the session's environment (exported variables, venvs).
+        """
+        if len(actions) < 2:
+            return [self.execute(action) for action in actions]
+        # Straight to the executor: the probe is bookkeeping, not part of the agent's history
+        cwd = self.executor.execute(Action("pwd", agent_name=actions[0].agent_name)).output.strip().splitlines()
+        cwd = cwd[-1] if cwd and cwd[-1].startswith("/") else "/workspace"
+        head_chars, tail_chars = getattr(self.executor, "head_chars", 20000), getattr(self.executor, "tail_chars", 50000)
+
+        def run(action):
+            started, start_time = time.time(), time.monotonic()
+            try:
+                process = subprocess.run(["docker", "exec", "-w", cwd, self.container_name, "bash", "-c", action.command],
+                                         capture_output=True, timeout=timeout)
+                raw, exit_code, killed = process.stdout + process.stderr, process.returncode, None
+            except subprocess.TimeoutExpired as e:
+                raw, exit_code, killed = (e.stdout or b"") + (e.stderr or b""), ExecutorBase.TIMEOUT_EXIT_CODE, "timeout"
+            capture = BoundedCapture(head_chars, tail_chars)
+            capture.write(raw.decode("utf-8", errors="replace").rstrip("\n"))
+            output = capture.getvalue()
+            result = BashOutput(output, exit_code=exit_code, wall_time=time.monotonic() - start_time, raw_bytes=len(raw),
+                                output_bytes=len(output.encode("utf-8", errors="replace")), truncated=capture.truncated,
+                                killed=killed)
+            return started, result
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(run, actions))
+
+        states = []
+        for action, (started, result) in zip(actions, results):
+            state = State(action, result.output, result=result)
+            self._record(state, started)
+            if self.state_callback is not None:
+                self.state_callback(state)
+            if self.verbose:
+                print(state)
+            states.append(state)
+        return states
+
+    def replay(self, states: list, skip_agents=("TEST",)):
+        """
+        Re-run the commands of checkpointed states in this (fresh) container to rebuild its state,
+        without calling the LLM. The new results go into the history but not to state_callback,
+        since the checkpoint already holds them.
+        """
+        for state in states:
+            action = state.action
+            if action.agent_name in skip_agents or not action.command:
+                continue
+            print(f"[{self.REPO_NAME}] replaying: {action.command.splitlines()[0][:80]}")
+            started = time.time()
+            result = self.executor.execute(action)
+            self._record(State(action, result.output, result=result), started)
+
+    def set_eval(self, state: State, eval: str):
+        state.set_eval(eval)
+        self.history_log.append_eval(state.action.agent_name, self._log_index[id(state)], eval)
     
+    def _print_progress(self, command, bytes_read, bytes_per_sec, elapsed):
+        print(f"[{self.REPO_NAME}] still running after {elapsed:.0f}s: {bytes_read / 1024:.1f} KB output "
+              f"({bytes_per_sec / 1024:.1f} KB/s) - {command.splitlines()[0][:80]}")
+
     def close(self):
-        """Close executor and remove container."""
-        self.log_environment_history()
+        """Close executor and remove container. Safe to call more than once."""
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+
+        if hasattr(self, "history_log"):
+            self.history_log.close()
+            self.log_environment_history()
 
         if hasattr(self, "executor"):
             self.executor.close()
 
-        if not self.keep_docker:
+        if self.pool is not None:
+            self.pool.release(self.container_name, keep=self.keep_docker)
+        elif not self.keep_docker:
             subprocess.run(["docker", "rm", "-f", self.container_name],
                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        # Only remove this environment's checkout; other environments may be running in parallel
+        if not self.keep_repo:
+            shutil.rmtree(self.repo_path, ignore_errors=True)
     
     def _read_test_script_commands(self, bash_file):
-        commands = []
-        current_cmd = []
-
-        with open(bash_file) as f:
-            for line in f:
-                line = line.strip()
-                # skip comments and empty lines
-                if not line or line.startswith("#"):
-                    continue
-
-                # if line ends with \, continue building the command
-                if line.endswith("\\"):
-                    current_cmd.append(line[:-1].strip())
-                else:
-                    current_cmd.append(line)
-                    # end of a full command
-                    commands.append(" ".join(current_cmd))
-                    current_cmd = []
-
-        return commands
-
-    def run_test_scripts(self, num):
+        return [command for _, command in read_test_script(bash_file)]
+
+    def run_test_scripts(self, num, eval_mode="overlap"):
+        """
+        Run the benchmark test script for repo `num` and grade each command.
+
+        eval_mode:
+            "serial"  - grade each command right after it runs
+            "overlap" - grade command i in the background while command i+1 runs
+            "batch"   - run every command, then grade them all in one request
+        """
         print('RUNNING TEST SCRIPTS')
         test_filepath = f"./data/CSR_bench_scripts/{num}.sh"
 
@@ -106,41 +238,46 @@ class Environment:
         self.execute(Action("cd /workspace", agent_name="TEST"))
         self.execute(Action("ls", agent_name="TEST"))
 
-        commands = self._read_test_script_commands(test_filepath)
-        success = 0
-        for command in commands:
-            test_script_command = Action(f"{command}", agent_name="TEST")
-            state = self.execute(test_script_command)
-            output = state.output
+        staged_commands = read_test_script(test_filepath)
+        commands = [command for _, command in staged_commands]
+        states = []
+        pending = []
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            for stage, command in staged_commands:
+                test_script_command = Action(f"{command}", agent_name="TEST")
+                state = self.execute(test_script_command, stage=stage)
+                states.append(state)
+
+                if eval_mode == "serial":
+                    pending.append(self.evaluator.query(bash_script=command, output=state.output, exit_code=state.exit_code))
+                elif eval_mode == "overlap":
+                    pending.append(pool.submit(self.evaluator.query, bash_script=command, output=state.output, exit_code=state.exit_code))
 
-            result = self.evaluator.query(bash_script=command, output=output)
+            if eval_mode == "batch":
+                results = self.evaluator.query_batch([(command, state.output, state.exit_code) for command, state in zip(commands, states)])
+            elif eval_mode == "overlap":
+                results = [future.result() for future in pending]
+            else:
+                results = pending
+
+        success = 0
+        for state, result in zip(states, results):
             if result:
                 success += 1
-                self.history['TEST'][-1].set_eval('SUCCESS')
+                self.set_eval(state, 'SUCCESS')
             else:
-                self.history['TEST'][-1].set_eval('FAILED')
+                self.set_eval(state, 'FAILED')
         
         total = len(commands)
+        stats = self.evaluator.classifier.stats
+        print(f"Test script grading: {self.evaluator.classifier.calls_saved} / {total} decided by rules, "
+              f"{stats['escalated']} sent to the LLM")
         return f"{success} / {total}"
 
-    def log_environment_history(self, pretty=True):
-        for agent_name in self.history.keys():
-
-            log_file = f"logs/{self.name}_{agent_name}.jsonl"
-
-            # Ensure directory exists
-            os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
-
-            with open(log_file, "a", encoding="utf-8") as f:
-                for state in self.history[agent_name]:
-                    log_entry = {
-                        "timestamp": datetime.utcnow().isoformat() + "Z",
-                        "state": state.to_dict() if not pretty else str(state)
-                    }
-                    if pretty:
-                        f.write(f"{log_entry['timestamp']}\n{log_entry['state']}\n{'-'*60}\n")
-                    else:
-                        f.write(json.dumps(log_entry) + "\n")
+    def log_environment_history(self):
+        """Render the pretty per-agent logs (logs/<name>_<agent>.log) from the JSONL history log."""
+        return render_pretty(self.history_log.path)
 
     def __enter__(self):
         return self
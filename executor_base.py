@@ -0,0 +1,88 @@
+import re
+import time
+from typing import Optional
+
+
+class Watchdog:
+    """
+    Tracks one running command: its overall and inactivity budgets, and progress reports.
+    Executors call `output()` for every chunk read and `check()` whenever they wake up.
+    """
+
+    def __init__(self, command: str, start_time: float, timeout: float, idle_timeout: Optional[float],
+                 progress_callback=None, progress_interval=5):
+        self.command = command
+        self.start_time = start_time
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.progress_callback = progress_callback
+        self.progress_interval = progress_interval
+        self.bytes_read = 0
+        self.last_output = start_time
+        self.last_progress = start_time
+
+    def output(self, nbytes: int):
+        self.bytes_read += nbytes
+        self.last_output = time.monotonic()
+
+    def check(self) -> Optional[str]:
+        """Report progress when due; return why the command should be interrupted, or None."""
+        now = time.monotonic()
+        if now - self.start_time > self.timeout:
+            return f"timed out after {self.timeout}s"
+        if self.idle_timeout is not None and now - self.last_output > self.idle_timeout:
+            return f"no output for {self.idle_timeout}s"
+
+        if self.progress_callback and now - self.last_progress >= self.progress_interval:
+            elapsed = now - self.start_time
+            self.progress_callback(self.command, self.bytes_read, self.bytes_read / elapsed if elapsed else 0.0, elapsed)
+            self.last_progress = now
+        return None
+
+
+class ExecutorBase:
+    """
+    Per-command budgets and interrupt reporting shared by the executor backends
+    (CommandExecutor, DockerAPIExecutor). Subclasses set `timeout`, `idle_timeout`,
+    `progress_callback` and `progress_interval`.
+    """
+
+    # Per-command budgets: (pattern, timeout, idle_timeout). The first match wins; commands that
+    # match nothing get the executor's configured budgets. A rule only ever extends those (see
+    # _timeouts_for); None leaves the configured idle_timeout as is.
+    TIMEOUT_RULES = [
+        (re.compile(r"\bapt(?:-get)?\s+(?:install|update|upgrade)\b"), 1800, None),
+        (re.compile(r"\b(?:pip3?|conda|mamba|uv)\s+(?:pip\s+)?install\b"), 1800, None),
+        (re.compile(r"\b(?:git\s+clone|wget|curl)\b"), 1800, None),
+        (re.compile(r"\bpython3?\b.*\b(?:train|finetune|fit)\w*"), 7200, 1800),
+    ]
+
+    # Exit code reported for commands killed by the watchdog (same as GNU timeout)
+    TIMEOUT_EXIT_CODE = 124
+
+    def _timeouts_for(self, command: str):
+        """
+        Default budgets for `command`: the larger of the matching rule's and the executor's
+        configured ones, so a rule never shortens a budget the user raised. An executor
+        idle_timeout of None (no inactivity limit) stays None.
+        """
+        for pattern, timeout, idle_timeout in self.TIMEOUT_RULES:
+            if pattern.search(command):
+                if self.idle_timeout is not None and idle_timeout is not None:
+                    return max(self.timeout, timeout), max(self.idle_timeout, idle_timeout)
+                return max(self.timeout, timeout), self.idle_timeout
+        return self.timeout, self.idle_timeout
+
+    def _watchdog(self, command: str, start_time: float, timeout=None, idle_timeout=None) -> Watchdog:
+        """Watchdog for `command`; explicit budgets override the TIMEOUT_RULES defaults."""
+        default_timeout, default_idle = self._timeouts_for(command)
+        return Watchdog(command, start_time,
+                        timeout if timeout is not None else default_timeout,
+                        idle_timeout if idle_timeout is not None else default_idle,
+                        progress_callback=self.progress_callback, progress_interval=self.progress_interval)
+
+    def _mark_killed(self, result, reason: str):
+        result.exit_code = self.TIMEOUT_EXIT_CODE
+        result.killed = reason
+        result.output = f"{result.output}\n[command interrupted: {reason}]".lstrip("\n")
+        return result
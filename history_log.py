@@ -0,0 +1,133 @@
+import threading
+import json
+import time
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+from state import State
+
+
+def _isoformat(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class HistoryLog:
+    """
+    Write-ahead log of an Environment's history: one JSON line per executed State, appended as
+    soon as the command finishes, so a crash loses at most the last `fsync_interval` seconds.
+
+        {"type": "meta",  "repo": ..., "environment": ..., "run_id": ..., "started": ...}
+        {"type": "state", "agent": ..., "index": n, "stage": ..., "started": ..., "ended": ..., "duration": s, "state": {...}}
+        {"type": "eval",  "agent": ..., "index": n, "eval": "SUCCESS"}
+
+    Every line is flushed to the OS as it is written; fsync runs at most every `fsync_interval`
+    seconds, from a timer when no later write comes along (and on close). The human-readable
+    log is rendered from this file with `render_pretty`.
+    """
+
+    def __init__(self, path: str, fsync_interval=5.0, meta=None):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._last_sync = time.monotonic()
+        self._timer = None
+        if meta is not None:
+            self._write(dict(meta, type="meta", started=_isoformat(time.time())))
+
+    def _write(self, entry: dict):
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            self._file.flush()
+            wait = self.fsync_interval - (time.monotonic() - self._last_sync)
+            if wait <= 0:
+                self._fsync()
+            elif self._timer is None:
+                self._timer = threading.Timer(wait, self._sync_later)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _fsync(self):
+        os.fsync(self._file.fileno())
+        self._last_sync = time.monotonic()
+
+    def _sync_later(self):
+        with self._lock:
+            self._timer = None
+            if self._file is not None:
+                self._fsync()
+
+    def append(self, agent_name: str, index: int, state: State, started: float, ended: float, stage=None):
+        self._write({
+            "type": "state",
+            "agent": agent_name,
+            "index": index,
+            "stage": stage,
+            "started": _isoformat(started),
+            "ended": _isoformat(ended),
+            "duration": round(ended - started, 3),
+            "state": state.to_dict()
+        })
+
+    def append_eval(self, agent_name: str, index: int, eval: str):
+        self._write({"type": "eval", "agent": agent_name, "index": index, "eval": eval})
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+
+def read_history(path: str) -> dict:
+    """Rebuild {agent_name: [(entry, State), ...]} from a history log, applying evaluations."""
+    history = defaultdict(dict)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue    # torn last line
+            agent = entry.get("agent")
+            if entry["type"] == "state":
+                history[agent][entry["index"]] = (entry, State.from_dict(entry["state"], agent))
+            elif entry["type"] == "eval" and entry["index"] in history[agent]:
+                history[agent][entry["index"]][1].set_eval(entry["eval"])
+    return {agent: [states[i] for i in sorted(states)] for agent, states in history.items()}
+
+
+def render_pretty(path: str, out_prefix=None) -> list:
+    """
+    Write the pretty per-agent logs (`<prefix>_<agent>.log`) for a history log and return their paths.
+    Files are rewritten, not appended to, so rendering twice gives the same result.
+    """
+    out_prefix = out_prefix or os.path.splitext(path)[0]
+    written = []
+    for agent, entries in read_history(path).items():
+        out_path = f"{out_prefix}_{agent}.log"
+        with open(out_path, "w", encoding="utf-8") as f:
+            for entry, state in entries:
+                f.write(f"{entry['started']} ({entry['duration']:.1f}s)\n{state}\n{'-'*60}\n")
+        written.append(out_path)
+    return written
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2:
+        print("usage: python history_log.py logs/<environment>.jsonl [...]")
+        sys.exit(1)
+    for path in sys.argv[1:]:
+        for out_path in render_pretty(path):
+            print(out_path)
@@ -0,0 +1,168 @@
+from collections import deque
+from state import State
+
+
+class HistoryRenderer:
+    """
+    Renders an agent's command history into prompt text incrementally.
+
+    The last `keep_full` states are rendered in full; older states are collapsed to a compact
+    summary (the command plus the tail of its output). Both `keep_full` and `max_tokens` default
+    to None, which shows every command in full like the original benchmark prompts; windowing
+    changes what agents see, so scores are only comparable between runs with the same settings.
+    Each state is rendered at most once in each form, and the summarized prefix is only ever
+    appended to, so a step costs time proportional to the new states rather than the whole
+    transcript.
+
+    A running token estimate is kept; once it exceeds `max_tokens` the oldest summaries are
+    dropped from the front of the window.
+
+    For prompt caching, `render_split` separates a stable prefix from the rest: summaries are
+    frozen into the prefix `cache_chunk` at a time, and budget drops also happen in whole chunks,
+    so the prefix stays byte-identical for several steps in a row. Without windowing no state is
+    ever summarized, so full states are frozen the same way instead; a frozen state keeps the
+    text it had when it was frozen.
+    """
+
+    SEPARATOR = f"\n{'-' * 40}\n"
+
+    def __init__(self, keep_full=None, summary_lines=3, summary_chars=300, max_tokens=None, cache_chunk=8):
+        self.keep_full = keep_full
+        self.summary_lines = summary_lines
+        self.summary_chars = summary_chars
+        self.max_tokens = max_tokens
+        self.cache_chunk = max(1, cache_chunk)
+        self._reset(None)
+
+    def _reset(self, history):
+        self._history = history
+        self._summaries = deque()   # (text, tokens) for every summarized state still in the window
+        self._summarized = 0        # number of states (from the start) already collapsed to summaries
+        self._dropped = 0           # number of summaries dropped from the front by the token budget
+        self._summary_tokens = 0
+        self._full_cache = {}       # index -> (text, tokens) for states currently rendered in full
+        self._frozen_full = []      # texts of the leading full states frozen into the prefix (no windowing)
+
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        # ~4 characters per token is close enough for budgeting; no tokenizer round-trip needed
+        return len(text) // 4 + 1
+
+    def _summarize(self, state: State) -> str:
+        lines = [line for line in state.output.splitlines() if line.strip()]
+        tail = "\n".join(lines[-self.summary_lines:]) if self.summary_lines else ""
+        if len(tail) > self.summary_chars:
+            tail = "..." + tail[-self.summary_chars:]
+        omitted = max(0, len(lines) - self.summary_lines)
+
+        parts = ["Action:", State._indent(str(state.action))]
+        if omitted:
+            parts.append(f"Output (last {self.summary_lines} of {len(lines)} lines):")
+        else:
+            parts.append("Output:")
+        if tail:
+            parts.append(State._indent(tail))
+        if state.exit_code is not None:
+            parts.append(f"Exit code: {state.exit_code}")
+        if state.eval:
+            parts += ["Evaluation:", State._indent(state.eval)]
+        return "\n".join(parts)
+
+    def _full(self, index: int, state: State):
+        text = str(state)
+        cached = self._full_cache.get(index)
+        if cached is None or cached[0] is not text:
+            cached = (text, self._estimate_tokens(text))
+            self._full_cache[index] = cached
+        return cached
+
+    @property
+    def tokens(self) -> int:
+        """Estimated token count of the last rendered history."""
+        return self._summary_tokens + sum(tokens for _, tokens in self._full_cache.values())
+
+    def _update(self, history: list) -> list:
+        """Bring the window up to date with `history`; returns the (text, tokens) of the full states."""
+        if history is not self._history or len(history) < self._summarized:
+            self._reset(history)
+
+        # Collapse states that have left the full window into summaries (append-only)
+        boundary = max(0, len(history) - self.keep_full) if self.keep_full is not None else 0
+        while self._summarized < boundary:
+            text = self._summarize(history[self._summarized])
+            tokens = self._estimate_tokens(text)
+            self._summaries.append((text, tokens))
+            self._summary_tokens += tokens
+            self._full_cache.pop(self._summarized, None)
+            self._summarized += 1
+
+        full = [self._full(i, history[i]) for i in range(self._summarized, len(history))]
+        full_tokens = sum(tokens for _, tokens in full)
+
+        # Drop the oldest summaries until the window fits the token budget, a whole chunk at a time
+        if self.max_tokens:
+            while self._summaries and (self._summary_tokens + full_tokens > self.max_tokens
+                                       or (self._dropped and self._dropped % self.cache_chunk)):
+                _, tokens = self._summaries.popleft()
+                self._summary_tokens -= tokens
+                self._dropped += 1
+        return full
+
+    def render_split(self, history: list):
+        """Render as (stable prefix, rest); joined with SEPARATOR they equal `render(history)`."""
+        full = self._update(history)
+        frozen = self._summarized // self.cache_chunk * self.cache_chunk - self._dropped
+        summaries = [text for text, _ in self._summaries]
+
+        stable = []
+        if self._dropped:
+            stable.append(f"[{self._dropped} earlier commands omitted]")
+        stable += summaries[:max(0, frozen)]
+        rest = summaries[max(0, frozen):]
+
+        # Without windowing full states never turn into summaries, so they can be frozen too
+        if self.keep_full is None:
+            end = len(full) // self.cache_chunk * self.cache_chunk
+            while len(self._frozen_full) < end:
+                self._frozen_full.append(full[len(self._frozen_full)][0])
+            stable += self._frozen_full
+            full = full[len(self._frozen_full):]
+        rest += [text for text, _ in full]
+        return self.SEPARATOR.join(stable), self.SEPARATOR.join(rest)
+
+    def render(self, history: list) -> str:
+        return self.SEPARATOR.join(part for part in self.render_split(history) if part)
+
+    def render_prompt(self, template: str, history: list, **fields):
+        """
+        Format a prompt template with a `{history}` field into (cache prefix, rest): everything up to
+        the end of the stable history prefix, and the remainder. Concatenated they equal
+        `template.format(history=self.render(history), **fields)`.
+        """
+        head, tail = template.split("{history}", 1)
+        stable, rest = self.render_split(history)
+        # The separator goes with the rest, so the prefix doesn't change when the rest empties
+        if stable and rest:
+            rest = self.SEPARATOR + rest
+        return head.format(**fields) + stable, rest + tail.format(**fields)
+
+
+# Check that the cached prefix is non-empty and grows in fixed steps with default settings
+if __name__ == "__main__":
+    from state import Action, BashOutput
+
+    template = "[TASK]\n{history}\n[END]"
+    for renderer in (HistoryRenderer(), HistoryRenderer(keep_full=4, max_tokens=2000)):
+        history, prefixes = [], []
+        for i in range(30):
+            history.append(State(Action(f"echo {i}", "agent"), f"{i}\n" * 50, BashOutput(f"{i}\n" * 50, exit_code=0)))
+            prefix, rest = renderer.render_prompt(template, history)
+            assert prefix + rest == template.format(history=renderer.render(history))
+            prefixes.append(prefix)
+        changes = sum(a != b for a, b in zip(prefixes, prefixes[1:]))
+        assert len(prefixes[-1]) > len(template), "history never reaches the cached prefix"
+        assert changes <= len(history) // renderer.cache_chunk, "prefix changed between chunk boundaries"
+        if renderer.max_tokens is None:
+            assert all(b.startswith(a) for a, b in zip(prefixes, prefixes[1:])), "prefix was rewritten"
+        print(f"keep_full={renderer.keep_full}: prefix {len(prefixes[-1])} chars, "
+              f"changed on {changes} of {len(prefixes) - 1} turns")
@@ -3,20 +3,65 @@ from environment import Environment
 from test_agent_framework_HARD import HardTestAgent
 from test_agent_framework_EASY import EasyTestAgent
 from test_entrypoint_agent import EntrypointAgent
+from scheduler import BenchmarkScheduler, ResultsWriter
+from container_pool import ContainerPool
+from repo_cache import RepoCache
+from history_renderer import HistoryRenderer
+from core_agent import rate_limiter, configure_cache, configure_prompt_caching
+from checkpoint import RunCheckpoint
+from bench import Benchmark
+from metrics import MetricsRecorder, configure_otel, summary_table
 from datetime import datetime
-import subprocess
 import traceback
 
 parser = argparse.ArgumentParser(description='GSRBench100')
-parser.add_argument('--repo', type=str, help='Repository link', required=True)
-parser.add_argument('--docker', type=str, help='Docker image name', required=True)
+parser.add_argument('--repo', type=str, help='Repository link')
+parser.add_argument('--docker', type=str, help='Docker image name')
 parser.add_argument('--cycles', type=int, help='Number of cycles')
 parser.add_argument('--keepdocker', action='store_true', help='Keep docker container after running benchmark')
 parser.add_argument('--verbose', action='store_true')
-parser.add_argument('--agent', action='store_true', choices=['easy', 'hard', 'entrypoint'], help='Type of agent to run', required=True)
+parser.add_argument('--agent', type=str, choices=['easy', 'hard', 'entrypoint'], help='Type of agent to run')
 parser.add_argument('--keeprepo', action='store_true', help='Keep repo after running benchmark')
+parser.add_argument('--workers', type=int, default=1, help='Number of repos to benchmark in parallel')
+parser.add_argument('--retries', type=int, default=0, help='Number of times to retry a failed repo')
+parser.add_argument('--cpus', type=str, help='CPU limit per container (docker run --cpus)')
+parser.add_argument('--memory', type=str, help='Memory limit per container (docker run --memory)')
+parser.add_argument('--pool-size', type=int, default=0, help='Number of pre-started warm containers to lease from (0 disables the pool)')
+parser.add_argument('--pool-warmup', type=str, action='append', default=[], help='Command baked into the pool snapshot image (repeatable)')
+parser.add_argument('--repo-cache', type=str, help='Directory for the local bare-mirror repo cache (checkouts pinned to CSRBench100_commit_ids.json)')
+parser.add_argument('--repo-cache-size', type=float, default=20, help='Maximum repo cache size in GB')
+parser.add_argument('--history-window', type=int, help='Show only this many most recent commands with full output and summarize older ones (default: all in full, as in the original benchmark)')
+parser.add_argument('--history-tokens', type=int, help='Approximate token budget for the command history in each prompt (default: unlimited)')
+parser.add_argument('--rpm', type=int, default=50, help='LLM requests per minute shared across all parallel environments')
+parser.add_argument('--eval-mode', type=str, default='overlap', choices=['serial', 'overlap', 'batch'], help='How test script commands are graded')
+parser.add_argument('--llm-cache', type=str, choices=['read', 'write', 'readwrite'], help='Enable the on-disk LLM response cache in this mode')
+parser.add_argument('--llm-cache-path', type=str, default='./data/llm_cache.sqlite', help='SQLite file for the LLM response cache')
+parser.add_argument('--llm-cache-ttl', type=float, default=7, help='LLM response cache entry lifetime in days')
+parser.add_argument('--multi-tool', action='store_true', help='Let the agent issue several tool calls per model turn in a multi-turn conversation (read-only ones run concurrently)')
+parser.add_argument('--no-prompt-cache', action='store_true', help='Disable provider-side prompt caching of system prompts, tools and the stable history prefix')
+parser.add_argument('--stream-output', action='store_true', help='Stream command output to per-command log files and keep only a bounded head/tail in memory')
+parser.add_argument('--idle-timeout', type=int, default=600, help='Interrupt a command after this many seconds without output')
+parser.add_argument('--protocol', type=str, default='nonce', choices=['nonce', 'sync'], help='How command output is framed in the shell session')
+parser.add_argument('--backend', type=str, default='pexpect', choices=['pexpect', 'docker-api'], help='How commands are run in the container')
+parser.add_argument('--staged', action='store_true', help='Run the test script stage by stage with per-stage budgets and metrics (results/<repo>.json)')
+parser.add_argument('--no-short-circuit', action='store_true', help='With --staged, keep running later stages after a stage fails')
+parser.add_argument('--run-id', type=str, help='Id of a new run, used for its checkpoint under data/runs/ (defaults to the start timestamp)')
+parser.add_argument('--resume', type=str, help='Resume an interrupted run: skip finished repos and continue partial ones')
+parser.add_argument('--metrics-dir', type=str, default='./logs/metrics', help='Directory for per-repo JSON metrics (LLM latency, tokens, cost, command and cycle timings)')
+parser.add_argument('--otel', type=str, nargs='?', const='http://localhost:4318/v1/traces', help='Also export metrics as OpenTelemetry spans to this OTLP/HTTP collector endpoint')
 args = parser.parse_args()
 
+# Arguments that define what a run benchmarks; a resumed run takes them from its manifest
+RUN_ARGS = ('repo', 'docker', 'cycles', 'agent', 'eval_mode')
+
+checkpoint = None
+if args.resume:
+    checkpoint = RunCheckpoint.load(args.resume)
+    for key in RUN_ARGS:
+        setattr(args, key, checkpoint.manifest['args'][key])
+elif not (args.repo and args.docker and args.agent):
+    parser.error('--repo, --docker and --agent are required unless --resume is given')
+
 REPO_LINK = args.repo
 DOCKER_IMAGE_NAME = args.docker
 NUM_CYCLES = args.cycles
@@ -24,81 +69,194 @@ KEEP_DOCKER = args.keepdocker
 VERBOSE = args.verbose
 AGENT = args.agent
 KEEP_REPO = args.keeprepo
+NUM_WORKERS = args.workers
+MAX_RETRIES = args.retries
+CPUS = args.cpus
+MEMORY = args.memory
+POOL_SIZE = args.pool_size
+POOL_WARMUP = args.pool_warmup
+REPO_CACHE_DIR = args.repo_cache
+REPO_CACHE_SIZE = args.repo_cache_size
+HISTORY_WINDOW = args.history_window
+HISTORY_TOKENS = args.history_tokens
+EVAL_MODE = args.eval_mode
+
+rate_limiter.configure(args.rpm)
+configure_prompt_caching(not args.no_prompt_cache)
+
+if args.otel:
+    configure_otel(endpoint=args.otel)
+
+llm_cache = None
+if args.llm_cache:
+    llm_cache = configure_cache(path=args.llm_cache_path, mode=args.llm_cache, ttl=args.llm_cache_ttl * 24 * 3600)
 
 timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-results_file = f"./logs/results_{timestamp}.txt"
+if checkpoint is not None:
+    results_file = checkpoint.manifest['results_file']
+else:
+    results_file = f"./logs/results_{timestamp}.txt"
 
 with open("./data/meta/CSRBench100_full.txt") as f:
     repo_to_num = {line.strip(): i for i, line in enumerate(f, start=1)}
 
 
-if REPO_LINK == "ALL":
+if checkpoint is not None:
+    REPO_LINKS = checkpoint.manifest['repos']
+elif REPO_LINK == "ALL":
     with open("./data/meta/CSRBench100_full.txt") as f:
         REPO_LINKS = [line.strip() for line in f]
 else:
     REPO_LINKS = [f'{REPO_LINK}']
 
+if checkpoint is None:
+    checkpoint = RunCheckpoint.create(args.run_id or timestamp, {
+        'args': {key: getattr(args, key) for key in RUN_ARGS},
+        'repos': REPO_LINKS,
+        'results_file': results_file
+    })
+print(f"Run id: {checkpoint.run_id} (resume with --resume {checkpoint.run_id})")
+
+results = ResultsWriter(results_file)
+
+repo_cache = None
+commit_ids = {}
+if REPO_CACHE_DIR:
+    repo_cache = RepoCache(cache_dir=REPO_CACHE_DIR, max_size_bytes=int(REPO_CACHE_SIZE * 1024 ** 3))
+    commit_ids = RepoCache.load_pins()
+
+pool = None
+if POOL_SIZE > 0:
+    pool = ContainerPool(
+        image_name=DOCKER_IMAGE_NAME,
+        size=POOL_SIZE,
+        warmup_commands=POOL_WARMUP,
+        cpus=CPUS,
+        memory=MEMORY
+    )
+
+# Metrics of the latest attempt at each repo, for the summary table
+repo_metrics = {}
+
 def run_agent(agent, env, REPO_NAME):
+    """Run the agent and return (record, success). Errors are folded into the record."""
+    # Cycles replayed from a checkpoint count against the budget; in multi-tool mode the commands
+    # of one model turn share a turn id and count as one cycle
+    history = env.history[agent.name]
+    replayed = len({state.action.turn or id(state) for state in history})
     try:
-        if NUM_CYCLES:
-            output, count = agent.run(env, cycles=NUM_CYCLES)
+        if history and history[-1].signals_setup_complete():
+            output, count = 1, 0    # finished before the interruption
+        elif NUM_CYCLES and replayed >= NUM_CYCLES:
+            output, count = 0, 0    # budget already spent
+        elif NUM_CYCLES:
+            output, count = agent.run(env, cycles=NUM_CYCLES - replayed)
         else:
             output, count = agent.run(env)
-        with open(results_file, "a") as f:
-            f.write(f"{REPO_NAME}: {output}, Cycles: {count}")
+        return f"{REPO_NAME}: {output}, Cycles: {count + replayed}", True
     except Exception as e:
-        with open(results_file, "a") as f:
-            f.write(f"{REPO_NAME}: ERROR during agent run - {e}\n")
-            f.write(traceback.format_exc() + "\n")
+        return f"{REPO_NAME}: ERROR during agent run - {e}\n{traceback.format_exc()}", False
 
-for repo_link in REPO_LINKS:
+def run_test_scripts(env, repo_number, REPO_NAME):
+    try:
+        result = env.run_test_scripts(repo_number, eval_mode=EVAL_MODE)
+        return f", Test Results: {result}"
+    except Exception as e:
+        return f"\n{REPO_NAME}: ERROR during test scripts - {e}\n{traceback.format_exc()}"
+
+def run_staged(env, repo_number, REPO_NAME):
+    try:
+        summary = Benchmark(env, short_circuit=not args.no_short_circuit).run(test_number=repo_number)['summary']
+        stopped = f" (stopped after {summary['stopped_by']})" if summary['stopped_by'] else ""
+        return f", Test Results: {summary['passed']} / {summary['commands']}{stopped}"
+    except Exception as e:
+        return f"\n{REPO_NAME}: ERROR during staged test scripts - {e}\n{traceback.format_exc()}"
+
+def run_repo(repo_link, slot):
     repo_number = repo_to_num[repo_link]
     REPO_NAME = repo_link.rsplit('/', 1)[-1]
+    env = None
+    metrics = MetricsRecorder(REPO_NAME)
+    repo_metrics[REPO_NAME] = metrics
+
+    prior_states = checkpoint.take_pending(repo_link)
+    checkpoint.start(repo_link, resumed=bool(prior_states))
 
     try:
         env = Environment(
             repo_link,
+            keep_repo=KEEP_REPO,
             keep_docker=KEEP_DOCKER,
             image_name=DOCKER_IMAGE_NAME,
-            verbose=VERBOSE
+            verbose=VERBOSE,
+            cpus=CPUS,
+            memory=MEMORY,
+            pool=pool,
+            repo_cache=repo_cache,
+            commit_id=commit_ids.get(repo_link.rstrip('/')),
+            stream_output=args.stream_output,
+            idle_timeout=args.idle_timeout,
+            protocol=args.protocol,
+            backend=args.backend,
+            state_callback=lambda state: checkpoint.record_state(repo_link, state),
+            run_id=checkpoint.run_id,
+            metrics=metrics
         )
+        if prior_states:
+            print(f"[{REPO_NAME}] resuming from {len(prior_states)} checkpointed commands")
+            env.replay(prior_states)
 
+        renderer = HistoryRenderer(keep_full=HISTORY_WINDOW, max_tokens=HISTORY_TOKENS)
         if AGENT == 'entrypoint':
-            agent = EntrypointAgent()
-            run_agent(agent, env, REPO_NAME)
-        elif AGENT == 'HARD':
-            agent = HardTestAgent()
-            run_agent(agent, env, REPO_NAME)
-            try:
-                result = env.run_test_scripts(repo_number)
-                with open(results_file, "a") as f:
-                    f.write(f", Test Results: {result}\n")
-            except Exception as e:
-                with open(results_file, "a") as f:
-                    f.write(f"{REPO_NAME}: ERROR during test scripts - {e}\n")
-                    f.write(traceback.format_exc() + "\n")
+            agent = EntrypointAgent(renderer=renderer, multi_tool=args.multi_tool)
+            metrics.attach(agent.LLM, agent.name)
+            record, success = run_agent(agent, env, REPO_NAME)
+        elif AGENT == 'hard':
+            agent = HardTestAgent(renderer=renderer, multi_tool=args.multi_tool)
+            metrics.attach(agent.LLM, agent.name)
+            record, success = run_agent(agent, env, REPO_NAME)
+            record += run_staged(env, repo_number, REPO_NAME) if args.staged else run_test_scripts(env, repo_number, REPO_NAME)
         else:
-            agent = EasyTestAgent(test_number=repo_number)
-            run_agent(agent, env, REPO_NAME)
-            try:
-                result = env.run_test_scripts(repo_number)
-                with open(results_file, "a") as f:
-                    f.write(f", Test Results: {result}\n")
-            except Exception as e:
-                with open(results_file, "a") as f:
-                    f.write(f"{REPO_NAME}: ERROR during test scripts - {e}\n")
-                    f.write(traceback.format_exc() + "\n")
+            agent = EasyTestAgent(test_number=repo_number, renderer=renderer, multi_tool=args.multi_tool)
+            metrics.attach(agent.LLM, agent.name)
+            record, success = run_agent(agent, env, REPO_NAME)
+            record += run_staged(env, repo_number, REPO_NAME) if args.staged else run_test_scripts(env, repo_number, REPO_NAME)
+
+        summary = metrics.summary()
+        record += (f", LLM: {summary['llm_calls']} calls / ${summary['cost']:.3f} "
+                   f"(prompt cache read/write: {summary['cache_read_input_tokens']}/{summary['cache_creation_input_tokens']} tokens), "
+                   f"Commands: {summary['command_seconds']:.0f}s")
+        results.write(record)
+        checkpoint.finish(repo_link, success, record)
+        return success
 
     except Exception as e:
-        with open(results_file, "a") as f:
-            f.write(f"{REPO_NAME}: FATAL ERROR - {e}\n")
-            f.write(traceback.format_exc() + "\n")
+        record = f"{REPO_NAME}: FATAL ERROR - {e}\n{traceback.format_exc()}"
+        results.write(record)
+        checkpoint.finish(repo_link, False, record)
+        return False
 
     finally:
-        if not KEEP_REPO:
-            try:
-                subprocess.run(["./clear_repos.sh"], check=True)
-                env.close()
-            except subprocess.CalledProcessError as e:
-                with open(results_file, "a") as f:
-                    f.write(f"{REPO_NAME}: ERROR closing repo - {e}\n")
+        if env is not None:
+            env.close()
+            metrics.write(f"{args.metrics_dir}/{env.name}.json")
+
+scheduler = BenchmarkScheduler(run_repo, num_workers=NUM_WORKERS, max_retries=MAX_RETRIES, results_writer=results)
+for repo_link in REPO_LINKS:
+    if checkpoint.is_done(repo_link, MAX_RETRIES):
+        print(f"Skipping {repo_link}: finished in run {checkpoint.run_id}")
+        continue
+    scheduler.submit(repo_link, attempt=checkpoint.attempts[repo_link])
+try:
+    scheduler.run()
+finally:
+    checkpoint.close()
+    if pool is not None:
+        pool.close()
+    if llm_cache is not None:
+        results.write(f"LLM cache: {llm_cache.stats()}")
+        llm_cache.close()
+    if repo_metrics:
+        table = summary_table([metrics.summary() for metrics in repo_metrics.values()])
+        print(table)
+        results.write(f"Metrics summary:\n{table}")
@@ -0,0 +1,221 @@
+import threading
+import json
+import time
+import os
+from collections import defaultdict
+
+# USD per million tokens: (input, output, cache write, cache read)
+PRICING = {
+    "claude-sonnet-4": (3.00, 15.00, 3.75, 0.30),
+    "claude-3-7-sonnet": (3.00, 15.00, 3.75, 0.30),
+    "claude-3-5-haiku": (0.80, 4.00, 1.00, 0.08),
+    "claude-opus-4": (15.00, 75.00, 18.75, 1.50),
+}
+
+# Set by configure_otel(); every recorder also emits its events as spans when it is set
+_tracer = None
+
+
+def configure_otel(endpoint="http://localhost:4318/v1/traces", service_name="csr-bench"):
+    """Export LLM calls and commands as OpenTelemetry spans to a local OTLP/HTTP collector."""
+    global _tracer
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError as e:
+        raise RuntimeError("OpenTelemetry export needs opentelemetry-sdk and opentelemetry-exporter-otlp-proto-http") from e
+
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("csr-bench")
+    return provider
+
+
+def estimate_cost(model: str, input_tokens=0, output_tokens=0, cache_creation_tokens=0, cache_read_tokens=0):
+    """Estimated USD cost of one call, or None for a model without a price entry."""
+    for prefix, (input_price, output_price, write_price, read_price) in PRICING.items():
+        if model.startswith(prefix):
+            return (input_tokens * input_price + output_tokens * output_price
+                    + cache_creation_tokens * write_price + cache_read_tokens * read_price) / 1e6
+    return None
+
+
+class MetricsRecorder:
+    """
+    Collects timing, token and cost metrics for one repo's run.
+
+    LLM calls are reported by CoreAgents attached with `attach(core_agent, label)`; commands are
+    reported by the Environment. A cycle is the LLM calls made under a label followed by the
+    command that label's agent runs, so each agent command closes one per-cycle breakdown.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.time()
+        self.llm_calls = []
+        self.commands = []
+        self.cycles = []
+        self._pending = defaultdict(lambda: {"llm_calls": 0, "llm_seconds": 0.0, "prompt_tokens": 0,
+                                             "output_tokens": 0, "cost": 0.0})
+        self._lock = threading.Lock()
+
+    def attach(self, core_agent, label: str):
+        """Report `core_agent`'s LLM calls under `label` (use the agent's name to get per-cycle rows)."""
+        core_agent.attach_metrics(self, label)
+        return core_agent
+
+    def _span(self, name: str, start: float, end: float, attributes: dict):
+        if _tracer is None:
+            return
+        span = _tracer.start_span(name, start_time=int(start * 1e9),
+                                  attributes={k: v for k, v in attributes.items() if v is not None})
+        span.set_attribute("repo", self.name)
+        span.end(end_time=int(end * 1e9))
+
+    def record_llm_call(self, label: str, model: str, start: float, latency: float, total_seconds: float,
+                        usage=None, cached=False, attempts=1, error=None):
+        input_tokens = getattr(usage, "input_tokens", 0) or 0
+        output_tokens = getattr(usage, "output_tokens", 0) or 0
+        cache_creation = getattr(usage, "cache_creation_input_tokens", 0) or 0
+        cache_read = getattr(usage, "cache_read_input_tokens", 0) or 0
+        # Responses served from the local response cache cost nothing
+        cost = 0.0 if cached else estimate_cost(model, input_tokens, output_tokens, cache_creation, cache_read)
+        call = {
+            "label": label,
+            "model": model,
+            "start": start,
+            "latency": round(latency, 3),
+            "total_seconds": round(total_seconds, 3),
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cache_creation_input_tokens": cache_creation,
+            "cache_read_input_tokens": cache_read,
+            "cost": cost,
+            "cached": cached,
+            "attempts": attempts,
+            "error": error
+        }
+        with self._lock:
+            self.llm_calls.append(call)
+            pending = self._pending[label]
+            pending["llm_calls"] += 1
+            pending["llm_seconds"] += total_seconds
+            pending["prompt_tokens"] += input_tokens + cache_creation + cache_read
+            pending["output_tokens"] += output_tokens
+            pending["cost"] += cost or 0.0
+        self._span("llm.call", start, start + total_seconds, dict(call, start=None))
+
+    def record_command(self, agent_name: str, command: str, result, start: float, end: float, stage=None):
+        entry = {
+            "agent": agent_name,
+            "command": (command or "")[:200],
+            "stage": stage,
+            "start": start,
+            "seconds": round(end - start, 3),
+            "exit_code": getattr(result, "exit_code", None),
+            "killed": getattr(result, "killed", None),
+            "output_bytes": getattr(result, "output_bytes", None)
+        }
+        with self._lock:
+            self.commands.append(entry)
+            if agent_name in self._pending:
+                cycle = self._pending.pop(agent_name)
+                cycle.update(agent=agent_name, cycle=sum(1 for c in self.cycles if c["agent"] == agent_name) + 1,
+                             command_seconds=entry["seconds"], exit_code=entry["exit_code"])
+                cycle["llm_seconds"] = round(cycle["llm_seconds"], 3)
+                cycle["total_seconds"] = round(cycle["llm_seconds"] + entry["seconds"], 3)
+                self.cycles.append(cycle)
+        self._span("command", start, end, dict(entry, start=None))
+
+    def summary(self) -> dict:
+        with self._lock:
+            calls = list(self.llm_calls)
+            commands = list(self.commands)
+            cycles = len(self.cycles)
+
+        by_label = defaultdict(lambda: defaultdict(float))
+        for call in calls:
+            totals = by_label[call["label"]]
+            totals["calls"] += 1
+            totals["cached"] += call["cached"]
+            totals["errors"] += call["error"] is not None
+            totals["llm_seconds"] += call["total_seconds"]
+            for key in ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens"):
+                totals[key] += call[key]
+            totals["cost"] += call["cost"] or 0.0
+        latencies = sorted(call["latency"] for call in calls if not call["cached"] and call["error"] is None)
+
+        return {
+            "name": self.name,
+            "wall_time": round(time.time() - self.started, 3),
+            "llm_calls": len(calls),
+            "llm_seconds": round(sum(call["total_seconds"] for call in calls), 3),
+            "llm_latency_p50": latencies[len(latencies) // 2] if latencies else None,
+            "llm_latency_max": latencies[-1] if latencies else None,
+            "input_tokens": sum(call["input_tokens"] for call in calls),
+            "output_tokens": sum(call["output_tokens"] for call in calls),
+            "cache_creation_input_tokens": sum(call["cache_creation_input_tokens"] for call in calls),
+            "cache_read_input_tokens": sum(call["cache_read_input_tokens"] for call in calls),
+            "cost": round(sum(call["cost"] or 0.0 for call in calls), 4),
+            "commands": len(commands),
+            "command_seconds": round(sum(command["seconds"] for command in commands), 3),
+            "cycles": cycles,
+            "by_label": {label: {key: round(value, 4) for key, value in totals.items()} for label, totals in by_label.items()}
+        }
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "summary": None,
+                "llm_calls": list(self.llm_calls),
+                "commands": list(self.commands),
+                "cycles": list(self.cycles)
+            }
+
+    def write(self, path: str):
+        data = self.to_dict()
+        data["summary"] = self.summary()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        return path
+
+
+SUMMARY_COLUMNS = [
+    ("name", "Repo", "{}"),
+    ("cycles", "Cycles", "{}"),
+    ("commands", "Cmds", "{}"),
+    ("command_seconds", "Cmd s", "{:.0f}"),
+    ("llm_calls", "LLM calls", "{}"),
+    ("llm_seconds", "LLM s", "{:.0f}"),
+    ("llm_latency_p50", "p50 s", "{:.2f}"),
+    ("input_tokens", "In tok", "{}"),
+    ("output_tokens", "Out tok", "{}"),
+    ("cache_read_input_tokens", "Cache rd", "{}"),
+    ("cache_creation_input_tokens", "Cache wr", "{}"),
+    ("cost", "Cost $", "{:.3f}"),
+]
+
+
+def summary_table(summaries: list) -> str:
+    """Plain-text table of recorder summaries with a total row."""
+    rows = list(summaries)
+    if rows:
+        total = {key: sum(row[key] or 0 for row in rows) for key, _, _ in SUMMARY_COLUMNS[1:]}
+        total["name"] = "TOTAL"
+        latencies = sorted(row["llm_latency_p50"] for row in rows if row["llm_latency_p50"] is not None)
+        total["llm_latency_p50"] = latencies[len(latencies) // 2] if latencies else None
+        rows.append(total)
+
+    def cell(row, key, fmt):
+        value = row.get(key)
+        return "-" if value is None else fmt.format(value)
+
+    table = [[title for _, title, _ in SUMMARY_COLUMNS]]
+    table += [[cell(row, key, fmt) for key, _, fmt in SUMMARY_COLUMNS] for row in rows]
+    widths = [max(len(line[i]) for line in table) for i in range(len(SUMMARY_COLUMNS))]
+    return "\n".join("  ".join(value.ljust(width) for value, width in zip(line, widths)) for line in table)
@@ -0,0 +1,149 @@
+import subprocess
+import threading
+import hashlib
+import shutil
+import json
+import os
+
+
+class RepoCache:
+    """
+    Local bare-mirror cache for benchmark repositories, keyed by repo URL.
+
+    Each URL gets one bare repository under `cache_dir`. Pinned commits are fetched into it
+    shallowly (`--depth`) the first time they are needed and kept under `refs/heads/pinned/<sha>`,
+    so later checkouts of the same commit don't touch the network at all.
+
+    Checkouts are local clones of the mirror (objects are hardlinked where the filesystem allows)
+    with `origin` pointed back at the real URL. Unlike `--reference` clones or worktrees, the
+    checkout has no paths back into the cache, so it still works when mounted into a container.
+
+    Total cache size is bounded: least recently used mirrors are evicted once `max_size_bytes`
+    is exceeded.
+    """
+
+    def __init__(self, cache_dir="./data/repo_cache", max_size_bytes=20 * 1024 ** 3, depth=1):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size_bytes = max_size_bytes
+        self.depth = depth
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._in_use = set()
+
+    @staticmethod
+    def load_pins(path="./data/meta/CSRBench100_commit_ids.json") -> dict:
+        """Map repo URL -> pinned commit id from the benchmark's commit id file."""
+        with open(path) as f:
+            data = json.load(f)
+        return {url.rstrip('/'): value[0] for url, value in data.items()}
+
+    def _mirror_path(self, repo_url: str) -> str:
+        name = repo_url.rstrip('/').rsplit('/', 1)[-1]
+        digest = hashlib.sha1(repo_url.rstrip('/').encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{name}-{digest}.git")
+
+    def _key_lock(self, mirror: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(mirror, threading.Lock())
+
+    @staticmethod
+    def _git(*args, check=True, capture=False):
+        return subprocess.run(
+            ["git", *args],
+            check=check,
+            stdout=subprocess.PIPE if capture else subprocess.DEVNULL,
+            stderr=subprocess.PIPE if capture else None,
+            text=True
+        )
+
+    def _has_commit(self, mirror: str, commit: str) -> bool:
+        return self._git("-C", mirror, "cat-file", "-e", f"{commit}^{{commit}}", check=False, capture=True).returncode == 0
+
+    def _fetch(self, mirror: str, ref: str):
+        args = ["-C", mirror, "fetch", "--no-tags"]
+        if self.depth:
+            args.append(f"--depth={self.depth}")
+        self._git(*args, "origin", ref)
+
+    def _ensure_mirror(self, repo_url: str, mirror: str, commit=None) -> str:
+        """Make sure `mirror` holds the requested commit (or the remote HEAD) and return its sha."""
+        if not os.path.isdir(mirror):
+            tmp = f"{mirror}.tmp-{os.getpid()}-{threading.get_ident()}"
+            shutil.rmtree(tmp, ignore_errors=True)
+            self._git("init", "--bare", "-q", tmp)
+            self._git("-C", tmp, "remote", "add", "origin", repo_url)
+            os.replace(tmp, mirror)
+
+        if commit:
+            if not self._has_commit(mirror, commit):
+                print(f"Fetching {repo_url}@{commit[:12]} into cache")
+                self._fetch(mirror, commit)
+            self._git("-C", mirror, "update-ref", f"refs/heads/pinned/{commit}", commit)
+            return commit
+
+        # Unpinned: follow the remote HEAD when online, otherwise fall back to the last one seen
+        try:
+            self._fetch(mirror, "HEAD")
+            self._git("-C", mirror, "update-ref", "refs/heads/latest", "FETCH_HEAD")
+        except subprocess.CalledProcessError:
+            if not self._has_commit(mirror, "refs/heads/latest"):
+                raise
+            print(f"Could not reach {repo_url}, using cached checkout")
+        return self._git("-C", mirror, "rev-parse", "refs/heads/latest", capture=True).stdout.strip()
+
+    def checkout(self, repo_url: str, dest: str, commit=None):
+        """Check out `repo_url` (at `commit` if given) into `dest` using the local mirror."""
+        repo_url = repo_url.rstrip('/')
+        mirror = self._mirror_path(repo_url)
+
+        with self._lock:
+            self._in_use.add(mirror)
+        try:
+            with self._key_lock(mirror):
+                sha = self._ensure_mirror(repo_url, mirror, commit)
+                os.utime(mirror)
+
+                self._git("clone", "-q", "--no-checkout", mirror, dest)
+            self._git("-C", dest, "remote", "set-url", "origin", repo_url)
+            self._git("-C", dest, "checkout", "-q", "--detach", sha)
+        finally:
+            with self._lock:
+                self._in_use.discard(mirror)
+
+        self.evict()
+        return sha
+
+    @staticmethod
+    def _dir_size(path: str) -> int:
+        total = 0
+        for root, _, files in os.walk(path):
+            for f in files:
+                try:
+                    total += os.lstat(os.path.join(root, f)).st_size
+                except OSError:
+                    pass
+        return total
+
+    def evict(self):
+        """Remove least recently used mirrors until the cache fits in `max_size_bytes`."""
+        if not self.max_size_bytes:
+            return
+
+        with self._lock:
+            mirrors = []
+            for entry in os.listdir(self.cache_dir):
+                path = os.path.join(self.cache_dir, entry)
+                if entry.endswith(".git") and os.path.isdir(path):
+                    mirrors.append((os.path.getmtime(path), path, self._dir_size(path)))
+
+            total = sum(size for _, _, size in mirrors)
+            for _, path, size in sorted(mirrors):
+                if total <= self.max_size_bytes:
+                    break
+                if path in self._in_use:
+                    continue
+                print(f"Evicting {os.path.basename(path)} from repo cache")
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
@@ -0,0 +1,114 @@
+import threading
+import hashlib
+import sqlite3
+import json
+import time
+import os
+
+
+class ResponseCache:
+    """
+    On-disk, content-addressed cache of LLM responses backed by SQLite.
+
+    Entries are keyed by a hash of every request parameter (model id, system prompt, tools,
+    messages, sampling settings), so identical requests from a resumed run or a repeated
+    evaluation are answered locally.
+
+    mode:
+        "read"      - serve hits from the cache, never store new responses
+        "write"     - always query the API, store every response
+        "readwrite" - serve hits and store misses
+
+    Entries older than `ttl` seconds are ignored and purged; once `max_entries` is exceeded the
+    least recently used entries are evicted.
+    """
+
+    MODES = ("read", "write", "readwrite")
+
+    def __init__(self, path="./data/llm_cache.sqlite", mode="readwrite", ttl=7 * 24 * 3600, max_entries=100000):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}, expected one of {self.MODES}")
+        self.path = path
+        self.mode = mode
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT,"
+            " response TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(**request) -> str:
+        payload = json.dumps(request, sort_keys=True, default=str, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @property
+    def readable(self) -> bool:
+        return self.mode in ("read", "readwrite")
+
+    @property
+    def writable(self) -> bool:
+        return self.mode in ("write", "readwrite")
+
+    def get(self, key: str):
+        """Return the cached response JSON for `key`, or None."""
+        if not self.readable:
+            return None
+
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.ttl and now - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return row[0]
+
+    def put(self, key: str, model: str, response_json: str):
+        if not self.writable:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, model, response_json, now, now)
+            )
+            self.writes += 1
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        if self.ttl:
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        if self.max_entries:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, "hits": self.hits, "misses": self.misses, "writes": self.writes}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
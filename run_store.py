@@ -0,0 +1,446 @@
+import statistics
+import sqlite3
+import json
+import glob
+import zlib
+import time
+import os
+import re
+from collections import defaultdict
+from bench_scripts import read_test_script, script_path, repo_numbers
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    kind TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    ingested REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    source_id INTEGER NOT NULL,
+    created REAL,
+    agent TEXT,
+    docker TEXT,
+    cycles INTEGER,
+    repos INTEGER,
+    results_file TEXT,
+    args TEXT
+);
+CREATE TABLE IF NOT EXISTS repo_results (
+    source_id INTEGER NOT NULL,
+    line INTEGER NOT NULL,
+    run_id TEXT,
+    repo TEXT NOT NULL,
+    outcome INTEGER,
+    cycles INTEGER,
+    tests_passed INTEGER,
+    tests_total INTEGER,
+    error TEXT,
+    PRIMARY KEY (source_id, line)
+);
+CREATE TABLE IF NOT EXISTS states (
+    source_id INTEGER NOT NULL,
+    run_id TEXT,
+    repo TEXT,
+    environment TEXT,
+    agent TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    stage TEXT,
+    command TEXT,
+    exit_code INTEGER,
+    eval TEXT,
+    started TEXT,
+    duration REAL,
+    wall_time REAL,
+    raw_bytes INTEGER,
+    output_bytes INTEGER,
+    truncated INTEGER,
+    killed TEXT,
+    PRIMARY KEY (source_id, agent, idx)
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    source_id INTEGER NOT NULL,
+    agent TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    output BLOB,
+    PRIMARY KEY (source_id, agent, idx)
+);
+CREATE TABLE IF NOT EXISTS entrypoints (
+    source_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    entrypoint TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS states_repo ON states(repo);
+CREATE INDEX IF NOT EXISTS states_agent ON states(agent);
+CREATE INDEX IF NOT EXISTS states_run ON states(run_id);
+CREATE INDEX IF NOT EXISTS states_stage ON states(stage, eval);
+CREATE INDEX IF NOT EXISTS states_exit_code ON states(exit_code);
+CREATE INDEX IF NOT EXISTS repo_results_repo ON repo_results(repo);
+CREATE INDEX IF NOT EXISTS repo_results_run ON repo_results(run_id);
+"""
+
+# "<repo>: <outcome>, Cycles: <n>[, Test Results: <passed> / <total>]" lines of logs/results_*.txt
+RESULT_LINE = re.compile(r"^(?P<repo>[^\s:]+): (?P<outcome>-?\d+), Cycles: (?P<cycles>\d+)"
+                         r"(?:, Test Results: (?P<passed>\d+) / (?P<total>\d+))?")
+ERROR_LINE = re.compile(r"^(?P<repo>[^\s:]+): (?P<error>(?:FATAL )?ERROR.*)$")
+# Environment names are "<repo>_benchmark_<hex>"; legacy pretty logs add "_<agent>.jsonl"
+ENV_NAME = re.compile(r"^(?P<repo>.+)_(?P<container>benchmark_[0-9a-f]{32})(?:_(?P<agent>.+))?$")
+PRETTY_SEPARATOR = "\n" + "-" * 60 + "\n"
+
+
+class RunStore:
+    """
+    Queryable archive of benchmark runs in one SQLite file.
+
+    `ingest()` walks logs/ and data/runs/ and loads, incrementally (a file is only re-read when
+    its size or mtime changed):
+        - run manifests (data/runs/*/manifest.json)          -> runs
+        - results files (logs/results_*.txt)                 -> repo_results
+        - history logs (logs/<environment>.jsonl), including
+          the older pretty-printed per-agent logs            -> states, outputs
+        - entrypoint lists (logs/entrypoints/*.txt)          -> entrypoints
+
+    States are kept narrow (one row per command, indexed on repo, agent, run, stage and exit
+    code); their outputs are zlib-compressed in a separate table so aggregate queries never read
+    them. Test-script commands without a recorded stage get it from the repo's script.
+    """
+
+    def __init__(self, path="./data/run_history.sqlite"):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._script_stages = {}
+        self._repo_numbers = None
+
+    # Ingestion
+
+    def ingest(self, log_dir="./logs", runs_dir="./data/runs") -> dict:
+        """Load new or changed files; returns the number of files ingested per kind."""
+        # Manifests first, so results files can be matched to their run ids
+        paths = sorted(glob.glob(os.path.join(runs_dir, "*", "manifest.json")))
+        paths += sorted(glob.glob(os.path.join(log_dir, "results_*.txt")))
+        paths += sorted(glob.glob(os.path.join(log_dir, "**", "*.jsonl"), recursive=True))
+        paths += sorted(glob.glob(os.path.join(log_dir, "entrypoints", "*.txt")))
+
+        counts = defaultdict(int)
+        for path in paths:
+            kind = self._ingest_file(path)
+            if kind:
+                counts[kind] += 1
+        return dict(counts)
+
+    def _ingest_file(self, path: str):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        row = self._conn.execute("SELECT id, mtime, size FROM sources WHERE path = ?", (path,)).fetchone()
+        if row is not None and row["mtime"] == stat.st_mtime and row["size"] == stat.st_size:
+            return None
+
+        name = os.path.basename(path)
+        if name == "manifest.json":
+            kind = "manifest"
+        elif name.startswith("results_") and name.endswith(".txt"):
+            kind = "results"
+        elif name.endswith(".jsonl"):
+            kind = "history"
+        else:
+            kind = "entrypoints"
+
+        with self._conn:
+            if row is not None:
+                source_id = row["id"]
+                for table in ("runs", "repo_results", "states", "outputs", "entrypoints"):
+                    self._conn.execute(f"DELETE FROM {table} WHERE source_id = ?", (source_id,))
+                self._conn.execute("UPDATE sources SET mtime = ?, size = ?, ingested = ? WHERE id = ?",
+                                   (stat.st_mtime, stat.st_size, time.time(), source_id))
+            else:
+                source_id = self._conn.execute(
+                    "INSERT INTO sources (path, kind, mtime, size, ingested) VALUES (?, ?, ?, ?, ?)",
+                    (path, kind, stat.st_mtime, stat.st_size, time.time())
+                ).lastrowid
+            getattr(self, f"_ingest_{kind}")(source_id, path)
+        return kind
+
+    def _ingest_manifest(self, source_id: int, path: str):
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        args = manifest.get("args", {})
+        self._conn.execute(
+            "INSERT OR REPLACE INTO runs (run_id, source_id, created, agent, docker, cycles, repos, results_file, args) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (manifest["run_id"], source_id, manifest.get("created"), args.get("agent"), args.get("docker"),
+             args.get("cycles"), len(manifest.get("repos", [])),
+             os.path.abspath(manifest["results_file"]) if manifest.get("results_file") else None, json.dumps(args))
+        )
+
+    def _run_for_results_file(self, path: str) -> str:
+        row = self._conn.execute("SELECT run_id FROM runs WHERE results_file = ?", (path,)).fetchone()
+        return row["run_id"] if row is not None else os.path.splitext(os.path.basename(path))[0]
+
+    def _ingest_results(self, source_id: int, path: str):
+        run_id = self._run_for_results_file(path)
+        rows = []
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for number, line in enumerate(f, start=1):
+                match = RESULT_LINE.match(line)
+                if match:
+                    rows.append((source_id, number, run_id, match["repo"], int(match["outcome"]), int(match["cycles"]),
+                                 int(match["passed"]) if match["passed"] else None,
+                                 int(match["total"]) if match["total"] else None, None))
+                    continue
+                match = ERROR_LINE.match(line)
+                if match:
+                    rows.append((source_id, number, run_id, match["repo"], None, None, None, None, match["error"][:500]))
+        self._conn.executemany("INSERT INTO repo_results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def _ingest_entrypoints(self, source_id: int, path: str):
+        name = os.path.splitext(os.path.basename(path))[0]
+        with open(path, encoding="utf-8", errors="replace") as f:
+            rows = [(source_id, name, line.strip()) for line in f if line.strip()]
+        self._conn.executemany("INSERT INTO entrypoints VALUES (?, ?, ?)", rows)
+
+    def _ingest_history(self, source_id: int, path: str):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            text = f.read()
+        first = text.lstrip()[:1]
+        if first == "{":
+            records = self._parse_history_jsonl(text)
+        else:
+            records = self._parse_history_pretty(text, path)
+
+        state_rows = []
+        output_rows = []
+        for record in records:
+            if record["agent"] == "TEST" and record["stage"] is None:
+                record["stage"] = self._stage_for(record["repo"], record["command"])
+            output = record.pop("output")
+            state_rows.append((source_id, record["run_id"], record["repo"], record["environment"], record["agent"],
+                               record["idx"], record["stage"], record["command"], record["exit_code"], record["eval"],
+                               record["started"], record["duration"], record["wall_time"], record["raw_bytes"],
+                               record["output_bytes"], record["truncated"], record["killed"]))
+            output_rows.append((source_id, record["agent"], record["idx"], zlib.compress((output or "").encode("utf-8"))))
+        self._conn.executemany("INSERT OR REPLACE INTO states VALUES (" + ", ".join("?" * 17) + ")", state_rows)
+        self._conn.executemany("INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?)", output_rows)
+
+    @staticmethod
+    def _record(**fields) -> dict:
+        record = dict.fromkeys(("run_id", "repo", "environment", "agent", "idx", "stage", "command", "exit_code",
+                                "eval", "started", "duration", "wall_time", "raw_bytes", "output_bytes",
+                                "truncated", "killed", "output"))
+        record.update(fields)
+        return record
+
+    def _parse_history_jsonl(self, text: str) -> list:
+        meta = {}
+        records = {}
+        for line in text.splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            kind = entry.get("type")
+            if kind == "meta":
+                meta = entry
+            elif kind == "state":
+                state = entry["state"]
+                result = state.get("result", {})
+                environment = meta.get("environment")
+                match = ENV_NAME.match(environment or "")
+                records[(entry["agent"], entry["index"])] = self._record(
+                    run_id=meta.get("run_id"),
+                    repo=match["repo"] if match else (meta.get("repo") or "").rstrip("/").rsplit("/", 1)[-1] or None,
+                    environment=environment,
+                    agent=entry["agent"],
+                    idx=entry["index"],
+                    stage=entry.get("stage"),
+                    command=state["action"].get("command"),
+                    exit_code=result.get("exit_code"),
+                    eval=state.get("eval"),
+                    started=entry.get("started"),
+                    duration=entry.get("duration"),
+                    wall_time=result.get("wall_time"),
+                    raw_bytes=result.get("raw_bytes"),
+                    output_bytes=result.get("output_bytes"),
+                    truncated=int(bool(result.get("truncated"))),
+                    killed=result.get("killed"),
+                    output=state.get("output")
+                )
+            elif kind == "eval" and (entry["agent"], entry["index"]) in records:
+                records[(entry["agent"], entry["index"])]["eval"] = entry["eval"]
+        return list(records.values())
+
+    def _parse_history_pretty(self, text: str, path: str) -> list:
+        """Parse the older pretty-printed `logs/<environment>_<agent>.jsonl` files."""
+        match = ENV_NAME.match(os.path.splitext(os.path.basename(path))[0])
+        if match is None or match["agent"] is None:
+            return []
+
+        records = []
+        for idx, block in enumerate(block for block in text.split(PRETTY_SEPARATOR) if block.strip()):
+            lines = block.strip("\n").split("\n")
+            sections = defaultdict(list)
+            section = None
+            exit_code = None
+            for line in lines[1:]:
+                if line in ("Action:", "Output:", "Evaluation:"):
+                    section = line[:-1].lower()
+                    continue
+                if line.startswith("Exit code: "):
+                    try:
+                        exit_code = int(line[len("Exit code: "):])
+                        continue
+                    except ValueError:
+                        pass
+                if section and section.startswith("action") and line in ("  command:", "  description:"):
+                    section = "action." + line.strip()[:-1]
+                    continue
+                if section in ("action.command", "action.description"):
+                    sections[section].append(line[4:])
+                elif section is not None:
+                    sections[section].append(line[2:])
+
+            output = "\n".join(sections["output"])
+            records.append(self._record(
+                repo=match["repo"],
+                environment=f"{match['repo']}_{match['container']}",
+                agent=match["agent"],
+                idx=idx,
+                command="\n".join(sections["action.command"]) or None,
+                exit_code=exit_code,
+                eval="\n".join(sections["evaluation"]) or None,
+                started=lines[0].split(" ")[0],
+                output_bytes=len(output.encode("utf-8")),
+                output=output
+            ))
+        return records
+
+    def _stage_for(self, repo: str, command: str):
+        """Stage of a test-script command, looked up in the repo's benchmark script."""
+        if not repo or not command:
+            return None
+        if repo not in self._script_stages:
+            if self._repo_numbers is None:
+                try:
+                    self._repo_numbers = repo_numbers()
+                except OSError:
+                    self._repo_numbers = {}
+            number = self._repo_numbers.get(repo)
+            stages = {}
+            if number is not None and os.path.exists(script_path(number)):
+                stages = {cmd: stage for stage, cmd in read_test_script(script_path(number))}
+            self._script_stages[repo] = stages
+        return self._script_stages[repo].get(command)
+
+    # Queries
+
+    def query(self, sql: str, params=()) -> list:
+        return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def output(self, source_id: int, agent: str, idx: int) -> str:
+        row = self._conn.execute("SELECT output FROM outputs WHERE source_id = ? AND agent = ? AND idx = ?",
+                                 (source_id, agent, idx)).fetchone()
+        return zlib.decompress(row["output"]).decode("utf-8") if row is not None else None
+
+    @staticmethod
+    def _filter(run_id=None, repo=None, column_prefix=""):
+        clauses, params = [], []
+        if run_id is not None:
+            clauses.append(f"{column_prefix}run_id = ?")
+            params.append(run_id)
+        if repo is not None:
+            clauses.append(f"{column_prefix}repo = ?")
+            params.append(repo)
+        return clauses, params
+
+    def stage_pass_rates(self, run_id=None, repo=None) -> list:
+        """Share of graded test-script commands that passed, per stage."""
+        clauses, params = self._filter(run_id, repo)
+        where = " AND ".join(["agent = 'TEST'", "eval IS NOT NULL"] + clauses)
+        return self.query(
+            "SELECT stage, COUNT(*) AS commands, SUM(eval = 'SUCCESS') AS passed, "
+            "ROUND(AVG(eval = 'SUCCESS'), 3) AS pass_rate, ROUND(AVG(duration), 1) AS mean_seconds "
+            f"FROM states WHERE {where} GROUP BY stage ORDER BY stage", params
+        )
+
+    def cycles_per_repo(self, run_id=None, repo=None) -> list:
+        """Median/min/max agent cycles and setup success rate per repo, from the results files."""
+        clauses, params = self._filter(run_id, repo)
+        where = " AND ".join(["cycles IS NOT NULL"] + clauses)
+        cycles = defaultdict(list)
+        outcomes = defaultdict(list)
+        for row in self._conn.execute(f"SELECT repo, cycles, outcome FROM repo_results WHERE {where}", params):
+            cycles[row["repo"]].append(row["cycles"])
+            outcomes[row["repo"]].append(row["outcome"])
+        return [{
+            "repo": repo,
+            "runs": len(values),
+            "median_cycles": statistics.median(values),
+            "min_cycles": min(values),
+            "max_cycles": max(values),
+            "success_rate": round(sum(1 for o in outcomes[repo] if o == 1) / len(values), 3)
+        } for repo, values in sorted(cycles.items())]
+
+    def exit_codes(self, run_id=None, repo=None, agent=None) -> list:
+        clauses, params = self._filter(run_id, repo)
+        if agent is not None:
+            clauses.append("agent = ?")
+            params.append(agent)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self.query(f"SELECT exit_code, COUNT(*) AS commands FROM states {where} "
+                          "GROUP BY exit_code ORDER BY commands DESC", params)
+
+    def close(self):
+        self._conn.close()
+
+
+def _print_table(rows: list):
+    if not rows:
+        print("(no rows)")
+        return
+    columns = list(rows[0].keys())
+    widths = [max(len(str(column)), *(len(str(row[column])) for row in rows)) for column in columns]
+    print("  ".join(str(column).ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Query the benchmark run history')
+    parser.add_argument('--db', type=str, default='./data/run_history.sqlite', help='SQLite file of the store')
+    parser.add_argument('--run', type=str, help='Restrict to one run id')
+    parser.add_argument('--repo', type=str, help='Restrict to one repo name')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    ingest = subparsers.add_parser('ingest', help='Load new and changed logs')
+    ingest.add_argument('--logs', type=str, default='./logs')
+    ingest.add_argument('--runs', type=str, default='./data/runs')
+    subparsers.add_parser('stages', help='Pass rate per test-script stage')
+    subparsers.add_parser('cycles', help='Cycles and success rate per repo')
+    subparsers.add_parser('exit-codes', help='Command count per exit code')
+    sql = subparsers.add_parser('sql', help='Run a read-only SQL query')
+    sql.add_argument('query', type=str)
+    args = parser.parse_args()
+
+    store = RunStore(args.db)
+    start = time.perf_counter()
+    if args.command == 'ingest':
+        print(store.ingest(log_dir=args.logs, runs_dir=args.runs))
+    elif args.command == 'stages':
+        _print_table(store.stage_pass_rates(run_id=args.run, repo=args.repo))
+    elif args.command == 'cycles':
+        _print_table(store.cycles_per_repo(run_id=args.run, repo=args.repo))
+    elif args.command == 'exit-codes':
+        _print_table(store.exit_codes(run_id=args.run, repo=args.repo))
+    else:
+        store.query("PRAGMA query_only = ON")
+        _print_table(store.query(args.query))
+    print(f"({(time.perf_counter() - start) * 1000:.1f} ms)")
+    store.close()
@@ -0,0 +1,95 @@
+import queue
+import threading
+import time
+import traceback
+
+
+class ResultsWriter:
+    """
+    Thread-safe writer for the results file.
+    Each call appends one complete record so concurrent workers never interleave lines.
+    """
+
+    def __init__(self, results_file: str):
+        self.results_file = results_file
+        self._lock = threading.Lock()
+
+    def write(self, text: str):
+        if not text.endswith("\n"):
+            text += "\n"
+        with self._lock:
+            with open(self.results_file, "a") as f:
+                f.write(text)
+                f.flush()
+
+
+class BenchmarkScheduler:
+    """
+    Runs benchmark repos across a fixed number of worker slots.
+
+    Each slot runs one Environment/agent pair at a time. Repos are pulled from a shared
+    work queue; a repo whose run fails is re-queued at the back of the queue so every
+    pending repo gets its first attempt before any repo gets a retry.
+
+    `run_repo(repo_link, slot)` does the actual work and returns True on success.
+    Raising an exception counts as a failure.
+    """
+
+    def __init__(self, run_repo, num_workers=1, max_retries=0, results_writer: ResultsWriter = None):
+        self.run_repo = run_repo
+        self.num_workers = max(1, num_workers)
+        self.max_retries = max(0, max_retries)
+        self.results_writer = results_writer
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.results = {}
+
+    def submit(self, repo_link: str, attempt: int = 0):
+        self._queue.put((repo_link, attempt))
+
+    def _worker(self, slot: int):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+
+            repo_link, attempt = item
+            start = time.time()
+            try:
+                success = bool(self.run_repo(repo_link, slot))
+            except Exception as e:
+                success = False
+                if self.results_writer:
+                    self.results_writer.write(f"{repo_link}: ERROR in worker slot {slot} - {e}\n{traceback.format_exc()}")
+            elapsed = time.time() - start
+
+            with self._lock:
+                self.results[repo_link] = {"success": success, "attempts": attempt + 1, "seconds": elapsed}
+
+            if not success and attempt < self.max_retries:
+                print(f"[slot {slot}] {repo_link} failed (attempt {attempt + 1}), re-queueing")
+                self.submit(repo_link, attempt + 1)
+            else:
+                print(f"[slot {slot}] {repo_link} finished: {'SUCCESS' if success else 'FAILED'} in {elapsed:.1f}s")
+
+            self._queue.task_done()
+
+    def run(self):
+        """Start the worker slots and block until the queue (including retries) is drained."""
+        workers = []
+        for slot in range(self.num_workers):
+            t = threading.Thread(target=self._worker, args=(slot,), name=f"bench-slot-{slot}", daemon=True)
+            t.start()
+            workers.append(t)
+
+        # Retries are enqueued before task_done() of the failed item, so join() covers them
+        self._queue.join()
+
+        for _ in workers:
+            self._queue.put(None)
+        for t in workers:
+            t.join()
+
+        return self.results
@@ -1,4 +1,7 @@
 from core_agent import CoreAgent
+import threading
+import json
+import re
 
 SYSTEM_PROMPT = """
 You are a strict evaluator of bash script executions.
@@ -28,6 +31,92 @@ PROMPT_TEMPLATE = """
 {output}
 """
 
+BATCH_SYSTEM_PROMPT = """
+You are a strict evaluator of bash script executions.
+You will be given a numbered list of commands from one bash script, each followed by
+the last 100 lines of the output it produced when run in a terminal, in execution order.
+
+Your job is to decide **only** whether each command executed successfully or not.
+
+Respond with a JSON array and nothing else, with one object per command in the same order:
+[{"index": 1, "verdict": "SUCCESS"}, {"index": 2, "verdict": "FAILED"}]
+
+**Important rules**
+
+* `verdict` must be exactly `SUCCESS` or `FAILED`.
+* Judge each command on its own output; do not explain your reasoning.
+* Assume any nonzero exit code, error messages, stack traces, command not found, or similar indications mean failure.
+* If uncertain, default to `FAILED`.
+"""
+
+BATCH_ITEM_TEMPLATE = """
+[COMMAND {index}]
+{bash_script}
+
+[OUTPUT {index}]
+{output}
+"""
+
+# Output that always means the command failed
+FAILURE_PATTERNS = re.compile("|".join([
+    r"command not found",
+    r"Traceback \(most recent call last\)",
+    r"\b(?:ModuleNotFoundError|ImportError|SyntaxError|FileNotFoundError)\b",
+    r"No such file or directory",
+    r"ERROR: (?:Could not find a version|No matching distribution|Could not open requirements file)",
+    r"error: subprocess-exited-with-error",
+    r"^fatal: ",
+    r"Segmentation fault",
+]), re.MULTILINE)
+
+# Output whose final line means the command succeeded
+SUCCESS_PATTERNS = re.compile("|".join([
+    r"^Successfully installed ",
+    r"^Requirement already satisfied: ",
+    r"^Successfully built ",
+]))
+
+class RuleClassifier():
+    """
+    Cheap local verdicts for test script outcomes that are obvious from the exit code and output.
+    Returns True/False when confident and None when the case should go to the LLM.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {"rule_success": 0, "rule_failed": 0, "escalated": 0}
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    @property
+    def calls_saved(self) -> int:
+        return self.stats["rule_success"] + self.stats["rule_failed"]
+
+    def classify(self, output: str, exit_code=None):
+        verdict = self._classify(output, exit_code)
+        if verdict is None:
+            self._count("escalated")
+        else:
+            self._count("rule_success" if verdict else "rule_failed")
+        return verdict
+
+    def _classify(self, output: str, exit_code):
+        if exit_code is not None and exit_code != 0:
+            return False
+
+        failure = FAILURE_PATTERNS.search(output) is not None
+        if exit_code is None and failure:
+            return False
+        if failure:
+            # Exit code 0 but error text in the output (e.g. a script that swallows errors)
+            return None
+
+        lines = [line for line in output.splitlines() if line.strip()]
+        if lines and SUCCESS_PATTERNS.match(lines[-1].strip()):
+            return True
+        return None
+
 class ScriptEvaluator():
     """
     Given a bash script and terminal output, determine if the script executed properly
@@ -35,6 +124,7 @@ class ScriptEvaluator():
     def __init__(self):
         self.LLM = CoreAgent(model_id="claude-sonnet-4-20250514")
         self.name = "test_script_agent"
+        self.classifier = RuleClassifier()
 
     def _get_last_100_lines(self, text: str):
         lines = text.splitlines()
@@ -42,7 +132,11 @@ class ScriptEvaluator():
         result = "\n".join(last_100_lines)
         return result
     
-    def query(self, bash_script: str, output: str):
+    def query(self, bash_script: str, output: str, exit_code=None):
+        verdict = self.classifier.classify(output, exit_code)
+        if verdict is not None:
+            return verdict
+
         prompt = PROMPT_TEMPLATE.format(bash_script=bash_script,
                                         output=self._get_last_100_lines(output)
                                         )
@@ -55,6 +149,57 @@ class ScriptEvaluator():
             return True
         else:
             return False
+
+    def query_batch(self, items: list):
+        """
+        Grade every (bash_script, output[, exit_code]) item of a test script in a single request.
+        Items the rule classifier is sure about are left out of the request.
+        Returns one bool per item; items missing from the model's answer count as failed.
+        """
+        verdicts = []
+        escalated = []
+        for position, item in enumerate(items):
+            bash_script, output = item[0], item[1]
+            exit_code = item[2] if len(item) > 2 else None
+            verdict = self.classifier.classify(output, exit_code)
+            verdicts.append(verdict)
+            if verdict is None:
+                escalated.append((position, bash_script, output))
+
+        if escalated:
+            prompt = "".join(
+                BATCH_ITEM_TEMPLATE.format(index=i, bash_script=bash_script, output=self._get_last_100_lines(output))
+                for i, (_, bash_script, output) in enumerate(escalated, start=1)
+            )
+            message = self.LLM.query(input_str=prompt,
+                                     system_prompt=BATCH_SYSTEM_PROMPT
+                                     )
+            results = self._parse_batch(message.content[0].text, len(escalated))
+            for (position, _, _), result in zip(escalated, results):
+                verdicts[position] = result
+
+        return verdicts
+
+    @staticmethod
+    def _parse_batch(text: str, count: int):
+        verdicts = [False] * count
+        match = re.search(r"\[.*\]", text, re.DOTALL)
+        if not match:
+            return verdicts
+        try:
+            entries = json.loads(match.group(0))
+        except json.JSONDecodeError:
+            return verdicts
+
+        for position, entry in enumerate(entries):
+            if isinstance(entry, dict):
+                index = entry.get("index", position + 1)
+                verdict = entry.get("verdict", "")
+            else:
+                index, verdict = position + 1, entry
+            if isinstance(index, int) and 1 <= index <= count:
+                verdicts[index - 1] = str(verdict).strip().upper() == "SUCCESS"
+        return verdicts
   
 
 if __name__ == "__main__":
@@ -1,13 +1,23 @@
 from typing import Optional
 
 class Action:
-    def __init__(self, command: str, agent_name: str, description: Optional[str] = None, ):
+    def __init__(self, command: str, agent_name: str, description: Optional[str] = None, turn: Optional[str] = None):
         self.command = command
         self.description = description
         self.agent_name = agent_name
+        # Id of the model turn that issued this action, when one turn issues several (multi-tool)
+        self.turn = turn
     
     def to_dict(self):
-        return {"command": self.command, "description": self.description}
+        data = {"command": self.command, "description": self.description}
+        if self.turn is not None:
+            data["turn"] = self.turn
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict, agent_name: str):
+        return cls(command=data.get("command"), agent_name=agent_name, description=data.get("description"),
+                   turn=data.get("turn"))
 
     def __str__(self):
         parts = []
@@ -23,62 +33,113 @@ class Action:
     def _indent(text, spaces=2):
         return "\n".join(" " * spaces + line for line in text.splitlines())
 
-# class BashOutput:
-#     def __init__(self, stdout: str, stderr: str, exit_code: int):
-#         self.stdout = stdout
-#         self.stderr = stderr
-#         self.exit_code = exit_code
+class BashOutput:
+    """
+    Result of running one command in the container.
+    stdout and stderr arrive interleaved through the PTY, so `output` holds both.
+    """
+    def __init__(self, output: str, exit_code: Optional[int] = None, wall_time: float = 0.0,
+                 raw_bytes: int = 0, output_bytes: int = 0, truncated: bool = False, log_path: Optional[str] = None,
+                 killed: Optional[str] = None):
+        self.output = output
+        self.exit_code = exit_code
+        self.wall_time = wall_time
+        self.raw_bytes = raw_bytes
+        self.output_bytes = output_bytes
+        self.truncated = truncated
+        self.log_path = log_path
+        # Why the executor interrupted the command, if it did
+        self.killed = killed
+
+    def to_dict(self):
+        return {
+            "exit_code": self.exit_code,
+            "wall_time": self.wall_time,
+            "raw_bytes": self.raw_bytes,
+            "output_bytes": self.output_bytes,
+            "truncated": self.truncated,
+            "log_path": self.log_path,
+            "killed": self.killed
+        }
+
+    @classmethod
+    def from_dict(cls, output: str, data: dict):
+        return cls(output, **data)
 
-#     def to_dict(self):
-#         return {"stdout": self.stdout, "stderr": self.stderr, "exit_code": self.exit_code}
+    def __str__(self):
+        parts = []
 
-#     def __str__(self):
-#         parts = []
+        if self.output.strip():
+            parts.append(f"output:\n{self._indent(self.output)}")
 
-#         if self.stdout.strip():
-#             parts.append(f"stdout:\n{self._indent(self.stdout)}")
-#         if self.stderr.strip():
-#             parts.append(f"stderr:\n{self._indent(self.stderr)}")
+        parts.append(f"exit code: {self.exit_code}")
+        return "\n".join(parts)
 
-#         parts.append(f"exit code: {self.exit_code}")
-#         return "\n".join(parts)
+    @staticmethod
+    def _indent(text, spaces=2):
+        return "\n".join(" " * spaces + line for line in text.splitlines())
 
-#     @staticmethod
-#     def _indent(text, spaces=2):
-#         return "\n".join(" " * spaces + line for line in text.splitlines())
+SETUP_COMPLETE = "__SETUP_COMPLETE__"
 
 class State:
-    def __init__(self, action: Action, output: str):
+    def __init__(self, action: Action, output: str, result: Optional[BashOutput] = None):
         self.action = action
         self.output = output
+        self.result = result
         self.eval = None
+        self._rendered = None
+
+    @property
+    def exit_code(self) -> Optional[int]:
+        return self.result.exit_code if self.result is not None else None
+
+    def signals_setup_complete(self) -> bool:
+        """An agent signals completion by printing __SETUP_COMPLETE__ from a successful command."""
+        if self.exit_code not in (None, 0):
+            return False
+        return SETUP_COMPLETE in self.output
     
     def to_dict(self):
+        data = {"action": self.action.to_dict(), "output": self.output}
+        if self.result is not None:
+            data["result"] = self.result.to_dict()
         if self.eval:
-            return {"action": self.action.to_dict(), "output": self.output, "eval": self.eval}
-        else:
-            return {"action": self.action.to_dict(), "output": self.output}
+            data["eval"] = self.eval
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict, agent_name: str):
+        """Rebuild a State written by to_dict (e.g. from a checkpoint journal)."""
+        result = BashOutput.from_dict(data["output"], data["result"]) if "result" in data else None
+        state = cls(Action.from_dict(data["action"], agent_name), data["output"], result=result)
+        state.eval = data.get("eval")
+        return state
     
     def set_eval(self, eval):
         self.eval = eval
+        self._rendered = None
 
     def __str__(self):
+        # Rendered once and reused; agents re-render the whole history every step
+        if self._rendered is None:
+            self._rendered = self._render()
+        return self._rendered
+
+    def _render(self):
+        text = (
+            "Action:\n"
+            f"{self._indent(str(self.action))}\n"
+            "Output:\n"
+            f"{self._indent(self.output)}"
+        )
+        if self.exit_code is not None:
+            text += f"\nExit code: {self.exit_code}"
         if self.eval:
-            return (
-                "Action:\n"
-                f"{self._indent(str(self.action))}\n"
-                "Output:\n"
-                f"{self._indent(self.output)}\n"
-                "Evaluation:\n"
+            text += (
+                "\nEvaluation:\n"
                 f"{self._indent(self.eval)}"
             )
-        else:
-            return (
-                "Action:\n"
-                f"{self._indent(str(self.action))}\n"
-                "Output:\n"
-                f"{self._indent(self.output)}"
-            )
+        return text
     
     def __repr__(self):
         return self.__str__()
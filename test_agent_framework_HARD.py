@@ -1,7 +1,9 @@
-from core_agent import CoreAgent
+from core_agent import CoreAgent, LLMError
 from base_agent import BaseAgent
 from environment import Environment
 from state import Action
+from history_renderer import HistoryRenderer
+from tool_loop import ToolLoop
 
 SYSTEM_PROMPT = """You are an assistant that helps execute software setup and usage instructions. You will be given:
 1. A minimal installation of ubuntu with the repository already pulled
@@ -42,16 +44,24 @@ PROMPT_TEMPLATE = """
 """
 
 class HardTestAgent():
-    def __init__(self):
+    def __init__(self, renderer: HistoryRenderer = None, multi_tool=False):
         self.LLM = CoreAgent(model_id="claude-sonnet-4-20250514")
         self.tools = [{"type": "bash_20250124", "name": "bash"}]
+        self.renderer = renderer if renderer is not None else HistoryRenderer()
         self.name = "test_agent"
+        # multi_tool: execute every tool call of a turn in a running conversation instead of one command per query
+        self.loop = ToolLoop(self.LLM, self.tools, SYSTEM_PROMPT, agent_name=self.name) if multi_tool else None
 
     def step(self, environment: Environment):
-        prompt = PROMPT_TEMPLATE.format(history=environment.history[self.name])
+        if self.loop is not None:
+            self.loop.step(environment, lambda: PROMPT_TEMPLATE.format(history=self.renderer.render(environment.history[self.name])))
+            return
+
+        prefix, prompt = self.renderer.render_prompt(PROMPT_TEMPLATE, environment.history[self.name])
         response = self.LLM.query_tools(input_str=prompt, 
                                    tools=self.tools,
-                                   system_prompt=SYSTEM_PROMPT
+                                   system_prompt=SYSTEM_PROMPT,
+                                   cache_prefix=prefix
                                    )
         
         text = None
@@ -77,8 +87,10 @@ class HardTestAgent():
                 count += 1
                 try:
                     self.step(environment)
-                    if "__SETUP_COMPLETE__" in environment.history[self.name][-1].output:
+                    if environment.history[self.name][-1].signals_setup_complete():
                         return 1, count
+                except LLMError:
+                    raise   # an API failure, not the agent's: reported as an error by the caller
                 except:
                     return 0, count
         else:
@@ -86,8 +98,10 @@ class HardTestAgent():
                 count += 1
                 try: 
                     self.step(environment)
-                    if "__SETUP_COMPLETE__" in environment.history[self.name][-1].output:
+                    if environment.history[self.name][-1].signals_setup_complete():
                         return 1, count
+                except LLMError:
+                    raise   # an API failure, not the agent's: reported as an error by the caller
                 except:
                     return 0, count
         return 0, count
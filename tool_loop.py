@@ -0,0 +1,134 @@
+import re
+import uuid
+import shlex
+from core_agent import CoreAgent
+from state import Action, State
+
+# Appended to an agent's system prompt in multi-tool mode
+MULTI_TOOL_PROMPT = """
+
+You may call the bash tool several times in one response when the commands do not depend on each
+other's output (for example reading several files). This overrides the one-command-at-a-time rule.
+The calls run in the order given and each result comes back as a tool result. Send the setup
+complete echo on its own once everything else is done."""
+
+# Commands that only read state; consecutive ones in a response run concurrently. They run in a
+# fresh shell that only shares the session's working directory, so commands whose answer depends
+# on the session's environment (PATH, activated venvs, exported variables) are left out, and so
+# are variable expansions
+READ_ONLY_COMMANDS = {
+    "ls", "cat", "head", "tail", "grep", "egrep", "rg", "find", "wc", "pwd", "tree", "file", "stat",
+    "du", "df", "nproc", "free", "uname", "nvidia-smi",
+}
+READ_ONLY_GIT = {"status", "log", "diff", "show", "branch", "remote", "rev-parse", "ls-files"}
+_UNSAFE = re.compile(r"[;&><`$]|\n|\s-(?:exec|execdir|delete|ok|fprint\w*)\b")
+
+
+def is_read_only(command: str) -> bool:
+    """Conservative check: every pipeline segment is a known read-only command, with no redirects or chaining."""
+    if not command or _UNSAFE.search(command):
+        return False
+    for segment in command.split("|"):
+        try:
+            words = shlex.split(segment)
+        except ValueError:
+            return False
+        if not words:
+            return False
+        if words[0] == "git":
+            if len(words) < 2 or words[1] not in READ_ONLY_GIT:
+                return False
+        elif words[0] not in READ_ONLY_COMMANDS:
+            return False
+    return True
+
+
+class ToolLoop:
+    """
+    Multi-turn tool-use conversation for an agent.
+
+    Every bash tool_use block of a model turn is executed in order (runs of consecutive read-only
+    commands concurrently, via Environment.execute_concurrent) and answered with tool_result blocks
+    in the next user message, so one round-trip can do several commands. The conversation restarts
+    from a freshly rendered prompt after `max_turns` turns to keep the context bounded.
+
+    Messages hold plain dicts (response blocks are model_dump'ed), so they stay JSON-serializable
+    for the response cache key.
+    """
+
+    def __init__(self, llm: CoreAgent, tools: list, system_prompt: str, agent_name: str,
+                 max_turns=10, concurrent_read_only=True, result_chars=4000):
+        self.llm = llm
+        self.tools = tools
+        self.system_prompt = system_prompt + MULTI_TOOL_PROMPT
+        self.agent_name = agent_name
+        self.max_turns = max_turns
+        self.concurrent_read_only = concurrent_read_only
+        self.result_chars = result_chars
+        self.messages = []
+        self.turns = 0
+
+    def _result_content(self, state: State) -> str:
+        output = state.output
+        if len(output) > self.result_chars:
+            output = "...\n" + output[-self.result_chars:]
+        return f"{output}\n[exit code: {state.exit_code}]" if state.exit_code is not None else output
+
+    def _execute(self, environment, actions: list) -> list:
+        """Execute actions in order, batching consecutive read-only commands. Stops after a completion signal."""
+        states = []
+        i = 0
+        while i < len(actions):
+            j = i + 1
+            if self.concurrent_read_only and is_read_only(actions[i].command):
+                while j < len(actions) and is_read_only(actions[j].command):
+                    j += 1
+            batch = actions[i:j]
+            states += environment.execute_concurrent(batch) if len(batch) > 1 else [environment.execute(batch[0])]
+            if states[-1].signals_setup_complete():
+                break
+            i = j
+        return states
+
+    def step(self, environment, render_prompt) -> list:
+        """
+        Run one model turn and return the new States. `render_prompt()` builds the opening user
+        message whenever a conversation (re)starts.
+        """
+        if not self.messages or self.turns >= self.max_turns:
+            self.messages = [{"role": "user", "content": render_prompt()}]
+            self.turns = 0
+
+        response = self.llm.query_messages(self.messages, tools=self.tools, system_prompt=self.system_prompt)
+        self.turns += 1
+
+        content = [block.model_dump(exclude_none=True) for block in response.content]
+        self.messages.append({"role": "assistant", "content": content})
+        text = "\n".join(block["text"] for block in content if block["type"] == "text") or None
+        calls = [block for block in content if block["type"] == "tool_use"]
+
+        if not calls:
+            print(f"Agent no command. Agent message: {text}")
+            state = environment.execute(Action(command=None, description=text, agent_name=self.agent_name))
+            self.messages.append({"role": "user", "content": "Continue with the next bash command."})
+            return [state]
+
+        # Actions of one model turn share a turn id, so a resumed run counts turns, not commands
+        turn = uuid.uuid4().hex[:12]
+        actions = [Action(command=call["input"].get("command"), description=text, agent_name=self.agent_name, turn=turn)
+                   for call in calls]
+        print(f"Agent current commands: {[action.command for action in actions]}")
+        states = self._execute(environment, actions)
+
+        results = []
+        for i, call in enumerate(calls):
+            if i < len(states):
+                result = {"type": "tool_result", "tool_use_id": call["id"], "content": self._result_content(states[i])}
+                if states[i].exit_code not in (0, None):
+                    result["is_error"] = True
+            else:
+                result = {"type": "tool_result", "tool_use_id": call["id"], "is_error": True,
+                          "content": "Not executed: an earlier command signalled completion."}
+            results.append(result)
+        self.messages.append({"role": "user", "content": results})
+        return states